@@ -0,0 +1,314 @@
+# Solver benchmarks
+#
+#   python3 benchmark.py precision              # float64 vs float32 on every table in data/
+#   python3 benchmark.py precision --json=precision.json
+#
+#   python3 benchmark.py suite --json=baseline.json         # every solver mode on every table
+#   python3 benchmark.py suite --modes=twiddle,line --synthetic=100x10,2000x20 --budget=10
+#   python3 benchmark.py suite --baseline=baseline.json --json=current.json
+#   python3 benchmark.py compare baseline.json current.json
+#
+# The suite runs each solver mode (MODES) on each table in data/ and on synthetic tables drawn
+# from the model, from the same seeded starting point, and measures:
+#   evaluate_us             one full evaluate()
+#   iterations_per_second   sweeps over all the parameters, solving for --budget seconds
+#   time_to_target          seconds until the error is within --target_ratio of the best final
+#                           error of any mode on that table (to the resolution of a batch)
+#   peak_kb                 peak traced allocation loading the table and running a few sweeps
+#
+# compare flags the measurements that got worse than the baseline by more than --threshold,
+# and exits with status 1 if there are any.  Times to target are only comparable for the same
+# target; the suite reuses the baseline's targets when given --baseline, then compares.
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import numpy as np
+from frequencytablesolver import FrequencyTableSolver
+
+# Solver modes for the suite: FrequencyTableSolver options
+MODES = {
+    'twiddle': {},
+    'line': {'search': 'line'},
+    'twiddle_multipliers': {'multipliers': 'twiddle'},
+    'jacobi': {'engine': 'jacobi'},
+    'lbfgs': {'engine': 'lbfgs'},
+    'float32': {'precision': 'float32'}
+}
+
+# compare: +1 where bigger is better, -1 where smaller is
+METRICS = {
+    'evaluate_us': -1,
+    'iterations_per_second': 1,
+    'time_to_target': -1,
+    'peak_kb': -1
+}
+
+
+def quiet_solver(table, seed, **options):
+    # The solver prints its data and state as it loads; keep that out of the report.
+    # table is a .csv file name or a job_data tuple, as from synthetic_table()
+    np.random.seed(seed)
+    random.seed(seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        solver = FrequencyTableSolver(**options)
+        if isinstance(table, str):
+            solver.read_csv_data(table)
+        else:
+            solver.update_job_data(table)
+            solver.initialize_parameter_list()
+        solver.get_random_starting_point()
+        solver.cast_solution()
+    return solver
+
+
+def synthetic_table(nrow, ncol, seed):
+    # A job_data tuple drawn from the model itself: Poisson counts around
+    # rm*cm*2**(-|rx-cx|**1.5), scaled to 20 per cell on average
+    rng = np.random.default_rng(seed)
+    rx, cx = rng.uniform(-1, 1, nrow), rng.uniform(-1, 1, ncol)
+    rm, cm = rng.lognormal(0, .5, nrow), rng.lognormal(0, .5, ncol)
+    expected = np.outer(rm, cm) * 2**(-np.abs(np.subtract.outer(rx, cx))**1.5)
+    data = rng.poisson(expected * 20 / expected.mean()).astype(float)
+    return (nrow, ncol, [f'c{j}' for j in range(ncol)], [f'r{i}' for i in range(nrow)], data)
+
+
+def time_evaluate(solver, repeats):
+    solver.evaluate()
+    t_start = time.perf_counter()
+    for repeat in range(repeats):
+        solver.evaluate()
+    return (time.perf_counter() - t_start) / repeats
+
+
+def benchmark_precision(file_name, precision, iterations, repeats, seed):
+    solver = quiet_solver(file_name, seed, precision=precision)
+    evaluate_seconds = time_evaluate(solver, repeats)
+    with contextlib.redirect_stdout(io.StringIO()):
+        t_start = time.perf_counter()
+        solver.solve(iterations=iterations)
+        solve_seconds = time.perf_counter() - t_start
+    error = solver.evaluate_float64()
+    return {
+        'file': file_name,
+        'shape': [solver.nrow, solver.ncol],
+        'precision': precision,
+        'evaluate_us': 1e6 * evaluate_seconds,
+        'iterations_per_second': iterations / solve_seconds,
+        'error': error,                                             # float64 re-evaluation
+        'working_error': float(solver.minimum_error),               # as tracked in the working precision
+    }
+
+
+def run_precision(args):
+    results = []
+    for file_name in sorted(glob.glob(args.data + '/*.csv')):
+        by_precision = {}
+        try:
+            for precision in ('float64', 'float32'):
+                by_precision[precision] = benchmark_precision(file_name, precision, args.iterations, args.repeats, args.seed)
+        except Exception as e:
+            print(f'{file_name}: skipped: {e}')
+            continue
+        results.extend(by_precision.values())
+        f64, f32 = by_precision['float64'], by_precision['float32']
+        print(f"{file_name} ({f64['shape'][0]} X {f64['shape'][1]})")
+        for result in (f64, f32):
+            print(f"    {result['precision']}: evaluate {result['evaluate_us']:9.1f} us  "
+                f"{result['iterations_per_second']:8.1f} iterations/s  error {result['error']:.6f}  "
+                f"(working {result['working_error']:.6f})")
+        print(f"    float32 speedup: evaluate {f64['evaluate_us'] / f32['evaluate_us']:.2f}x  "
+            f"solve {f32['iterations_per_second'] / f64['iterations_per_second']:.2f}x  "
+            f"relative error difference {abs(f32['error'] - f64['error']) / f64['error']:.2e}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'results written to {args.json}')
+
+
+def suite_tables(args):
+    # (name, table) for each table in data/ and each --synthetic size
+    for file_name in sorted(glob.glob(args.data + '/*.csv')):
+        yield file_name, file_name
+    for size in args.synthetic.split(','):
+        if not size.strip(): continue
+        nrow, ncol = (int(n) for n in size.lower().split('x'))
+        yield f'synthetic {nrow}x{ncol}', synthetic_table(nrow, ncol, args.seed)
+
+
+def benchmark_mode(table, mode, args):
+    # Time evaluate(), then solve in batches of about --batch_seconds for --budget seconds,
+    # keeping the error after each batch for time_to_target()
+    solver = quiet_solver(table, args.seed, **MODES[mode])
+    evaluate_seconds = time_evaluate(solver, args.repeats)
+    solver.batch_seconds = args.batch_seconds
+    trajectory = []         # (seconds, error) after each batch
+    with contextlib.redirect_stdout(io.StringIO()):
+        t_start = time.perf_counter()
+        while time.perf_counter() - t_start < args.budget:
+            solver.solve(iterations=solver.next_batch(1))
+            trajectory.append((time.perf_counter() - t_start, float(solver.minimum_error)))
+    return {
+        'shape': [solver.nrow, solver.ncol],
+        'mode': mode,
+        'evaluate_us': 1e6 * evaluate_seconds,
+        'iterations': solver.iterations_solved,
+        'iterations_per_second': solver.iterations_solved / trajectory[-1][0],
+        'final_error': solver.evaluate_float64(),
+        'trajectory': trajectory
+    }
+
+
+def peak_memory(table, mode, args):
+    # Peak allocation while loading the table and running a few sweeps, in KiB.  Traced apart
+    # from the timings, which tracemalloc would slow down.
+    tracemalloc.start()
+    try:
+        solver = quiet_solver(table, args.seed, **MODES[mode])
+        with contextlib.redirect_stdout(io.StringIO()):
+            solver.solve(iterations=args.memory_iterations)
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def time_to_target(trajectory, target):
+    for seconds, error in trajectory:
+        if error <= target: return seconds
+    return None
+
+
+def run_suite(args):
+    modes = args.modes.split(',') if args.modes else list(MODES)
+    for mode in modes:
+        if mode not in MODES: raise SystemExit(f'unknown mode: {mode}; choose from {", ".join(MODES)}')
+    baseline = load_results(args.baseline) if args.baseline else None
+    targets = {result['table']: result['target_error'] for result in baseline['results']} if baseline else {}
+
+    results = []
+    for name, table in suite_tables(args):
+        by_mode = {}
+        for mode in modes:
+            try:
+                result = benchmark_mode(table, mode, args)
+                result['peak_kb'] = peak_memory(table, mode, args)
+            except Exception as e:
+                print(f'{name} {mode}: skipped: {e}')
+                continue
+            by_mode[mode] = dict(result, table=name)
+        if not by_mode: continue
+
+        # the same target for every mode: near the best any of them reached, or the baseline's
+        target = targets.get(name) or args.target_ratio * min(result['final_error'] for result in by_mode.values())
+        print(f"{name} ({result['shape'][0]} X {result['shape'][1]})  target error {target:.6f}")
+        for mode, result in by_mode.items():
+            result['target_error'] = target
+            result['time_to_target'] = time_to_target(result.pop('trajectory'), target)
+            reached = f"{result['time_to_target']:7.2f} s" if result['time_to_target'] is not None else 'not reached'
+            print(f"    {mode:20} evaluate {result['evaluate_us']:9.1f} us  {result['iterations_per_second']:8.1f} iterations/s  "
+                f"target {reached}  peak {result['peak_kb']:9.1f} KiB  error {result['final_error']:.6f}")
+            results.append(result)
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'seed': args.seed,
+            'budget': args.budget,
+            'batch_seconds': args.batch_seconds,
+            'target_ratio': args.target_ratio
+        },
+        'results': results
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'results written to {args.json}')
+    if baseline:
+        return compare(baseline, report, args.threshold)
+
+
+def load_results(file_name):
+    with open(file_name) as f:
+        return json.load(f)
+
+
+def compare(baseline, current, threshold):
+    # Print each measurement that moved by more than threshold (relative) and return the
+    # number of regressions
+    base = {(result['table'], result['mode']): result for result in baseline['results']}
+    for key in ('seed', 'budget', 'batch_seconds'):
+        if baseline['meta'].get(key) != current['meta'].get(key):
+            print(f"note: {key} differs: {baseline['meta'].get(key)} in the baseline, {current['meta'].get(key)} now")
+    regressions = 0
+    for result in current['results']:
+        old = base.get((result['table'], result['mode']))
+        if old is None: continue
+        for metric, sense in METRICS.items():
+            if metric == 'time_to_target':
+                if old['target_error'] != result['target_error']: continue      # not comparable
+                if old[metric] is not None and result[metric] is None:
+                    print(f"REGRESSION  {result['table']} {result['mode']} {metric}: {old[metric]:.4g} -> target not reached")
+                    regressions += 1
+                    continue
+            if not old.get(metric) or result.get(metric) is None: continue
+            change = (result[metric] - old[metric]) / old[metric]
+            if abs(change) <= threshold: continue
+            worse = change * sense < 0
+            regressions += worse
+            print(f"{'REGRESSION' if worse else 'improved  '}  {result['table']} {result['mode']} {metric}: "
+                f"{old[metric]:.4g} -> {result[metric]:.4g} ({100 * change:+.1f}%)")
+    print(f'{regressions} regressions beyond {100 * threshold:.0f}%')
+    return regressions
+
+
+def run_compare(args):
+    return compare(load_results(args.baseline), load_results(args.current), args.threshold)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser('python3 benchmark.py')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    precision = subparsers.add_parser('precision', help='speed and accuracy of float32 vs float64 on each table')
+    precision.add_argument('--data', default='data')
+    precision.add_argument('--iterations', default=50, type=int)
+    precision.add_argument('--repeats', default=200, type=int)
+    precision.add_argument('--seed', default=1, type=int)
+    precision.add_argument('--json', default='')
+    precision.set_defaults(run=run_precision)
+
+    suite = subparsers.add_parser('suite', help='evaluate latency, sweep throughput, time to target and memory for each solver mode')
+    suite.add_argument('--data', default='data')
+    suite.add_argument('--synthetic', default='100x10,1000x20,3000x30', help='sizes of synthetic tables, as ROWSxCOLUMNS')
+    suite.add_argument('--modes', default='', help='comma-separated; default all of ' + ', '.join(MODES))
+    suite.add_argument('--budget', default=5, type=float, help='seconds of solving per mode and table')
+    suite.add_argument('--batch_seconds', default=.1, type=float)
+    suite.add_argument('--repeats', default=200, type=int, help='evaluate() calls to time')
+    suite.add_argument('--memory_iterations', default=3, type=int)
+    suite.add_argument('--target_ratio', default=1.001, type=float)
+    suite.add_argument('--seed', default=1, type=int)
+    suite.add_argument('--json', default='')
+    suite.add_argument('--baseline', default='', help='reuse its target errors, and compare against it')
+    suite.add_argument('--threshold', default=.1, type=float)
+    suite.set_defaults(run=run_suite)
+
+    compare_parser = subparsers.add_parser('compare', help='flag regressions between two suite results')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', default=.1, type=float, help='relative change that counts')
+    compare_parser.set_defaults(run=run_compare)
+
+    args = parser.parse_args()
+    sys.exit(1 if args.run(args) else 0)
@@ -0,0 +1,169 @@
+# Chart rendering for the swarm boss, in its own process
+#
+# matplotlib (and adjust_text, with hundreds of labels) can take seconds per chart.  The boss
+# hands snapshots of its best solution to a ChartRenderer and carries on; the render process
+# only ever draws the newest snapshot it has, and sends back the PNG bytes, which the boss
+# serves from memory.
+
+import io
+import multiprocessing as mp
+import queue
+import time
+import numpy as np
+
+
+ITERATIONS_TO_PLOT = 6      # solutions shown in the error vs. time plot
+
+
+def fitted_frequencies(solution):
+    # the model's table for a solution; see FrequencyTableSolver.evaluate()
+    rx, cx, rm, cm = (np.array(solution[key]) for key in ('rx', 'cx', 'rm', 'cm'))
+    return np.outer(rm, cm) * 2**(-np.abs(np.subtract.outer(rx, cx))**solution['a'])
+
+
+class LabelLayout():
+    # Remembers where adjust_text put one axis's labels, so that the next chart can reuse the
+    # layout when the points have barely moved instead of running adjust_text again
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance      # as a fraction of the coordinates' range
+        self.coordinates = None
+        self.positions = None           # (x, fraction of the axis height) for each label
+
+    def reusable(self, coordinates):
+        if self.coordinates is None or len(coordinates) != len(self.coordinates): return False
+        span = np.ptp(coordinates) or 1
+        return np.max(np.abs(coordinates - self.coordinates)) <= self.tolerance * span
+
+    def save(self, ax, coordinates, labels):
+        bottom, top = ax.get_ylim()
+        self.coordinates = np.array(coordinates)
+        self.positions = [(x, (y - bottom) / (top - bottom)) for x, y in (label.get_position() for label in labels)]
+
+    def apply(self, ax, coordinates, labels, text_base):
+        # the labels follow their points sideways; arrows as adjust_text would draw them
+        bottom, top = ax.get_ylim()
+        for label, x, old_x, (label_x, fraction) in zip(labels, coordinates, self.coordinates, self.positions):
+            position = (label_x + x - old_x, bottom + fraction * (top - bottom))
+            label.set_position(position)
+            if abs(position[0] - x) > 1e-12 or abs(position[1] - text_base) > 1e-12:
+                ax.annotate('', xy=(x, text_base), xytext=position, arrowprops=dict(arrowstyle='->', color='red'))
+
+
+def draw_labels(ax, coordinates, multipliers, names, layout, adjust):
+    props = {'color':'black'}
+    bottom, top = ax.get_ylim()
+    text_base = bottom + 0.05 * (top-bottom)
+    labels = []
+    for i in range(len(coordinates)):
+        labels.append(ax.text(coordinates[i], text_base, f'{names[i]} ({i} : {multipliers[i]:0.3f})', props, rotation=90))
+    if not adjust: return
+    if layout.reusable(coordinates):
+        layout.apply(ax, coordinates, labels, text_base)
+    else:
+        from adjustText import adjust_text
+        adjust_text(labels, arrowprops=dict(arrowstyle='->', color='red'))
+        layout.save(ax, coordinates, labels)
+
+
+def render_chart(fig, job, snapshot, layouts, adjust):
+    # job: the boss's static job description; snapshot: what ChartRenderer.submit() was given
+    solution = snapshot['solution']
+    fig.clf()
+    fig.set_size_inches(14, 14, forward=True)
+    fig.subplots_adjust(hspace=.3)
+    fig.suptitle(f'Analysis of {job["input_file_name"]} ({job["nrow"]} X {job["ncol"]})\nSolution {snapshot["chart_number"]}: error={snapshot["error"]} a={solution["a"]}', fontsize='xx-large')
+
+    # column analysis
+    ax = fig.add_subplot(4,1,1,
+        title = 'Column Coordinates and Multipliers',
+        xlabel = 'Column Coordinate',
+        ylabel = 'Column Multiplier')
+    ax.scatter(solution['cx'], solution['cm'])
+    draw_labels(ax, np.array(solution['cx']), solution['cm'], job['column_labels'], layouts['columns'], adjust)
+
+    # row analysis
+    ax2 = fig.add_subplot(4,1,2,
+        title = 'Row Coordinates and Multipliers',
+        xlabel = 'Row Coordinate',
+        ylabel = 'Row Multiplier')
+    ax2.scatter(solution['rx'], solution['rm'])
+    draw_labels(ax2, np.array(solution['rx']), solution['rm'], job['row_labels'], layouts['rows'], adjust)
+
+    # data heatmap
+    ax3 = fig.add_subplot(4,1,3,
+        title = 'Error Heat Map',
+        xlabel = 'Column',
+        ylabel = 'Row')
+    ax3.imshow(job['data'] - fitted_frequencies(solution), cmap='bwr', interpolation='nearest')
+
+    # error vs. time
+    t, e = snapshot['history']
+    if len(t):
+        ax4 = fig.add_subplot(4,1,4,
+            title = f'Error vs. Time for past {ITERATIONS_TO_PLOT} solutions',
+            xlabel = 'Time (seconds since start)',
+            ylabel = 'Error')
+        e_min = min(e)
+        e_max = max(e)
+        if e_max - e_min > 0:
+            ax4.set_ylim([e_min, e_max])
+            ax4.plot(t, e)
+
+    png = io.BytesIO()
+    fig.savefig(png, format='png')
+    return png.getvalue()
+
+
+def render_worker(job, adjust, tolerance, snapshots, charts):
+    # Runs in its own process: draw the newest snapshot, skipping any that were superseded
+    # while we were busy
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    fig = plt.figure()
+    layouts = {'columns': LabelLayout(tolerance), 'rows': LabelLayout(tolerance)}
+    job['data'] = np.array(job['data'])
+    while True:
+        try:
+            snapshot = snapshots.get(timeout=1)
+        except queue.Empty:
+            if not mp.parent_process().is_alive(): return
+            continue
+        while True:
+            try:
+                snapshot = snapshots.get_nowait()
+            except queue.Empty:
+                break
+        if snapshot is None: return
+        t_start = time.time()
+        png = render_chart(fig, job, snapshot, layouts, adjust)
+        charts.put((snapshot['chart_number'], png, time.time() - t_start))
+
+
+class ChartRenderer():
+
+    def __init__(self, job, adjust_text=False, layout_tolerance=.02):
+        # job: {'input_file_name', 'nrow', 'ncol', 'column_labels', 'row_labels', 'data'}
+        context = mp.get_context('spawn')
+        self.snapshots = context.Queue()
+        self.charts = context.Queue()
+        self.process = context.Process(target=render_worker, args=(job, adjust_text, layout_tolerance, self.snapshots, self.charts), daemon=True)
+        self.process.start()
+
+    def submit(self, snapshot):
+        # snapshot: {'chart_number', 'error', 'solution', 'history': (times, errors)}
+        self.snapshots.put(snapshot)
+
+    def poll(self):
+        # The newest finished chart as (chart_number, png, seconds), or None
+        chart = None
+        while True:
+            try:
+                chart = self.charts.get_nowait()
+            except queue.Empty:
+                return chart
+
+    def terminate(self):
+        self.snapshots.put(None)
+        self.process.join(timeout=2)
@@ -0,0 +1,85 @@
+# Frequency table loader shared by the boss and the solver
+#
+# A table is a CSV file: column labels across the first row, row labels down the first
+# column, counts in the rest, blank cells meaning 0.  The csv module takes care of quoted
+# labels, a byte order mark and blank or trailing lines.
+#
+# Parsing text is the slow part for big vote matrices, so the first load writes the parsed
+# table next to the CSV: <name>.csv.cache.npy holds the counts and <name>.csv.cache.json the
+# labels and the CSV's size, mtime and sha256.  Later loads memory-map the .npy instead of
+# parsing, as long as the CSV still matches (same size and mtime, or failing that, same hash).
+
+from array import array
+import csv
+import hashlib
+import json
+import os
+import numpy as np
+
+
+def parse_csv(file_name):
+    # Returns (column_labels, row_labels, data), streaming the rows straight into a float array
+    with open(file_name, 'r', encoding='utf-8-sig', newline='') as f:
+        rows = csv.reader(f)
+        column_labels = None
+        row_labels = []
+        values = array('d')
+        for row in rows:
+            if not any(cell.strip() for cell in row): continue
+            if column_labels is None:
+                column_labels = row[1:]
+                continue
+            if len(row) != len(column_labels) + 1:
+                raise ValueError(f'{file_name} line {rows.line_num}: {len(row) - 1} values for {len(column_labels)} columns')
+            row_labels.append(row[0])
+            values.extend(float(cell) if cell.strip() else 0.0 for cell in row[1:])
+    if column_labels is None:
+        raise ValueError(f'{file_name}: no data')
+    data = np.frombuffer(values, dtype=np.float64).reshape(len(row_labels), len(column_labels))
+    return column_labels, row_labels, data
+
+
+def file_hash(file_name):
+    h = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def read_table(file_name, cache=True):
+    # Returns (column_labels, row_labels, data); data is read-only when it comes from the cache
+    if not cache:
+        return parse_csv(file_name)
+
+    data_file, meta_file = file_name + '.cache.npy', file_name + '.cache.json'
+    stat = os.stat(file_name)
+    try:
+        with open(meta_file, 'r') as f:
+            meta = json.load(f)
+        if meta['size'] == stat.st_size and (meta['mtime_ns'] == stat.st_mtime_ns or meta['sha256'] == file_hash(file_name)):
+            data = np.load(data_file, mmap_mode='r')
+            if data.shape == (len(meta['row_labels']), len(meta['column_labels'])):
+                return meta['column_labels'], meta['row_labels'], data
+    except (OSError, ValueError, KeyError):
+        pass
+
+    column_labels, row_labels, data = parse_csv(file_name)
+    meta = {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': file_hash(file_name),
+        'column_labels': column_labels,
+        'row_labels': row_labels
+    }
+    # write then rename, so a concurrent start never maps a partial cache; a read-only
+    # data directory just means no cache
+    try:
+        np.save(data_file + '.tmp.npy', data)
+        os.replace(data_file + '.tmp.npy', data_file)
+        with open(meta_file + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_file + '.tmp', meta_file)
+    except OSError as e:
+        print(f'not caching {file_name}: {e}')
+    return column_labels, row_labels, data
@@ -1,22 +1,87 @@
  # Simple Solver for a Small Rectangular Table of Frequencies in .csv format, using Chi-Square as the Objective Fiunction
 from datetime import datetime
 import json
+import math
 import numpy as np
 import random
+from csvtable import read_table
+from metrics import Histogram
+from solutionlog import SolutionLog
 import time
 
 class FrequencyTableSolver():
 
-    def __init__(self):
+    def __init__(self, engine='twiddle', multipliers='exact', search='twiddle', precision='float64'):
 
-        np.seterr(all='raise')
+        # Floating-point problems are not trapped on every operation: a trial that under- or
+        # overflows just scores inf or nan and is rejected, and validate() checks the solution
+        # every validate_interval iterations
+        np.seterr(all='ignore')
         np.set_printoptions(precision=5)
         self.output_file_name = 'output.json'
+        self.verbose = False            # show_state(), and append to output_file_name, every 1000 iterations
 
         self.iteration = None
         self.minimum_error = None
-        self.one_dimensional_distances = None
-        self.products_of_multipliers = None
+        self.validate_interval = 100
+        self.last_valid_solution = None
+
+        # Working precision of the data, the solution and the evaluation kernels
+        if precision not in ('float32', 'float64'): raise Exception(f'Unknown precision: {precision}')
+        self.dtype = np.dtype(precision)
+
+        # Incremental evaluation: single-parameter trials recompute one row or column
+        self.incremental = True
+        self.resync_interval = 1000     # committed trials between full re-evaluations
+        self.cached_error = None
+        self.commits_since_resync = 0
+        self.trial = None
+
+        # Solver engines: each one advances the solution by one iteration of solve()
+        self.engines = {
+            'twiddle': self.sweep_twiddle,      # coordinate-wise +/- delta probing
+            'lbfgs': self.sweep_lbfgs,          # quasi-Newton steps on the analytic gradient
+            'jacobi': self.sweep_jacobi         # all rows at once, then all columns
+        }
+        if engine not in self.engines: raise Exception(f'Unknown solver engine: {engine}')
+        self.engine = engine
+        self.lbfgs_memory_size = 10
+        self.reset_lbfgs()
+
+        # Multipliers are either solved in closed form once per iteration ('exact')
+        # or probed one at a time like the coordinates ('twiddle')
+        if multipliers not in ('exact', 'twiddle'): raise Exception(f'Unknown multiplier mode: {multipliers}')
+        self.exact_multipliers = multipliers == 'exact'
+
+        # Each parameter is stepped either by trying +/- delta ('twiddle') or by a
+        # vectorized line search over a spread of multiples of delta ('line')
+        if search not in ('twiddle', 'line'): raise Exception(f'Unknown search mode: {search}')
+        self.search = search
+        self.line_offsets = np.array([-8, -4, -2, -1, -.5, -.25, .25, .5, 1, 2, 4, 8])
+        self.line_shrink = .25                  # delta scale after a search that found nothing
+        self.coordinate_step = .1               # where solve() starts the coordinates' deltas
+        self.multiplier_step = 1.1              # and the multipliers' (a factor)
+
+        # Tempering: above zero the twiddle and line searches also take some worse trials
+        # (see accepts()); the lbfgs steps and jacobi blocks stay pure descent
+        self.temperature = 0
+
+        # Adaptive batches and convergence: see next_batch() and converged()
+        self.batch_seconds = 0                  # wall-clock target for each solve(); 0 for fixed batches
+        self.batch_iterations = None            # size of the last solve()
+        self.iterations_solved = 0
+        self.error_list = []                    # [iterations solved, error] for each iteration on this solution
+        self.convergence_window = 1000          # iterations
+        self.convergence_ratio = 1e-6           # relative improvement over the window that counts as none
+        self.delta_tolerance = .01              # step sizes this far below where solve() starts them have collapsed
+
+        # Instrumentation (metrics.py): full evaluations and sweeps are timed, trials counted;
+        # the incremental trials themselves are too quick and too many to time
+        self.evaluate_histogram = Histogram()
+        self.sweep_histogram = Histogram()
+        self.accepted = 0
+        self.rejected = 0
+        self.seconds_solved = 0
 
         #self.initialize_starting_point()
 
@@ -39,17 +104,10 @@ class FrequencyTableSolver():
 
     def read_csv_data(self, file_name):
         print(f'loading file: {file_name}')
-        with open(file_name, 'r') as infile:
-            text = infile.read()
-        lines = text.split('\n')                    # split file in to lines separated by the invisible character \r
-        lines = [line.split(',') for line in lines] # convert each line to a list of its column values
-        input_as_array = np.array(lines)            # convert to np array format
-        self.column_labels = input_as_array[0,1:]   # first column of array (from second row to end)
-        self.row_labels = input_as_array[1:,0]      # first row of array (from second column to endd)
-        self.data = input_as_array[1:, 1:]
-        self.data[self.data==''] = 0.0
-        self.data = self.data.astype("float")
-        self.nrow, self.ncol = np.shape(self.data)
+        column_labels, row_labels, self.data = read_table(file_name)
+        self.column_labels = np.array(column_labels)
+        self.row_labels = np.array(row_labels)
+        self.allocate_workspace()
         print(f'row_labels: {self.row_labels}')
         print(f'column_labels: {self.column_labels}')
         print(f'data: {self.data}')
@@ -68,16 +126,14 @@ class FrequencyTableSolver():
                 'cx': self.cx.tolist(),
                 'rm': self.rm.tolist(),
                 'a': self.a,
-                'error': self.evaluate(),
-                'data': self.data.tolist()
+                'error': self.evaluate_float64(),
+                'data': self.data64.tolist()
                 #'fitted_frequencies': self.fitted_frequencies.tolist()
             }) + '\n')
 
 
     def load_solution_from_file(self, file_name, index=-1):
-        with open(file_name, 'r') as file:
-            solution = json.loads(file.read().strip().split('\n')[index])
-        return solution
+        return SolutionLog(file_name).read(index)
 
 
     def update_job_data(self, update):
@@ -85,22 +141,26 @@ class FrequencyTableSolver():
         self.ncol = update[1]
         self.column_labels = np.array(update[2])
         self.row_labels = np.array(update[3])
-        self.data = np.array(update[4])
+        self.data = np.asarray(update[4])           # no copy if it is already an array, e.g. in shared memory
+        self.allocate_workspace()
+        self.batch_iterations = None                # the pace of the last table says nothing about this one
+        self.error_list = []
 
 
     def get_random_starting_point(self):
         # Multipliers
         # Use the row and column factors of the standard zero correlation model for tabular data
-        self.total = np.sum(self.data)
+        self.total = np.sum(self.data64)
         print("total", self.total)
-        self.rm = np.sum(self.data, 1) / self.total**.5
-        self.cm = np.sum(self.data, 0) / self.total **.5
+        self.rm = np.sum(self.data64, 1) / self.total**.5
+        self.cm = np.sum(self.data64, 0) / self.total **.5
         #self.zero_correlation_model = np.outer(self.rm, self.cm)
 
         # Coordinates: Use random coordinates in the range + or = 1
         self.rx = 2.*(np.random.rand(self.nrow) - .5)
         self.cx = 2.*(np.random.rand(self.ncol) - .5)
         self.a = 2  # Initial estimate of attenuation
+        self.error_list = []
 
         self.standardize_multipliers()
 
@@ -125,19 +185,109 @@ class FrequencyTableSolver():
         self.cx = self.cx - s
 
 
-    def initialize_starting_point(self, tries=20, iterations=50):
+    def initialize_starting_point(self, tries=20, iterations=50, batched=True):
+        self.error_list = []
+        if batched:
+            return self.initialize_batched_starting_point(tries, iterations)
+
         best_error = None
         best_solution = None
         for random_start in range(tries):
             self.get_random_starting_point()
             self.show_state(f'Random start: {random_start}')
             self.solve(iterations=iterations)
-            if best_error is None or self.evaluate() < best_error:
+            error = self.evaluate()
+            if best_error is None or error < best_error:
+                best_error = error
                 best_solution = self.save_solution()
 
         #Continue from the best of the semi_starts.   Add lots of iterations.
         if best_solution is None: raise('no starting point')
         self.restore_solution(best_solution)
+        self.minimum_error = self.evaluate()
+
+
+    # Batched multi-start
+    #
+    # All candidate starting points are held as stacked arrays (K x nrow, K x ncol, K)
+    # and refined together by broadcasting against the data table.  Given the column
+    # parameters, each row's error depends only on its own coordinate and multiplier
+    # (and vice versa), so every improving row move of every candidate can be taken at
+    # once.  After each stage the worse half of the candidates is dropped.
+
+    def initialize_batched_starting_point(self, tries=20, iterations=50):
+        self.get_random_starting_point()    # zero correlation multipliers, shared by all candidates
+        rm = np.tile(self.rm, (tries, 1))
+        cm = np.tile(self.cm, (tries, 1))
+        rx = 2.*(np.random.rand(tries, self.nrow) - .5)
+        cx = 2.*(np.random.rand(tries, self.ncol) - .5)
+        s = rx.mean(1) + cx.mean(1)
+        rx -= s[:, None]
+        cx -= s[:, None]
+        a = np.full(tries, float(self.a))
+        rx_delta = np.full_like(rx, .1)
+        cx_delta = np.full_like(cx, .1)
+        a_delta = np.full(tries, .001)
+
+        stages = int(np.ceil(np.log2(tries))) + 1
+        rounds = max(1, iterations // stages)
+        while True:
+            for step in range(rounds):
+                rm, cm = self.batch_solve_multipliers(rx, cx, rm, cm, a)
+                rx, rx_delta = self.batch_move_coordinates(rx, cx, rm, cm, a, self.data, rx_delta)
+                cx, cx_delta = self.batch_move_coordinates(cx, rx, cm, rm, a, self.data.T, cx_delta)
+                a, a_delta = self.batch_move_attenuation(rx, cx, rm, cm, a, a_delta)
+            errors = np.sum(self.batch_slice_errors(rx, cx, rm, cm, a, self.data), 1)
+            if len(errors) == 1: break
+            keep = np.argsort(errors)[:(len(errors) + 1) // 2]
+            rx, cx, rm, cm, a = rx[keep], cx[keep], rm[keep], cm[keep], a[keep]
+            rx_delta, cx_delta, a_delta = rx_delta[keep], cx_delta[keep], a_delta[keep]
+
+        self.restore_solution((rx[0], cx[0], rm[0], cm[0], float(a[0])))
+        self.minimum_error = self.evaluate()
+        print(f'batched random start: {tries} tries, {stages} stages of {rounds} rounds, error={self.minimum_error:.5f}')
+
+
+    def batch_slice_errors(self, x, y, mx, my, a, data):
+        # Chi-square of each row of data (K x len(x)), for row coordinates/multipliers x, mx
+        # against column coordinates/multipliers y, my.  Pass data.T to get column errors.
+        # Trial points may under- or overflow; those rows score inf or nan and are never taken
+        with np.errstate(all='ignore'):
+            distances = np.absolute(x[:, :, None] - y[:, None, :])
+            fitted = mx[:, :, None] * my[:, None, :] * 2**(-(distances**a[:, None, None]))
+            return np.sum(((data - fitted)**2) / fitted, 2)
+
+
+    def batch_move_coordinates(self, x, y, mx, my, a, data, delta):
+        # The twiddle_row_coordinate() rule, applied to every coordinate of every candidate at once
+        current = self.batch_slice_errors(x, y, mx, my, a, data)
+        right = self.batch_slice_errors(x + delta, y, mx, my, a, data)
+        left = self.batch_slice_errors(x - delta, y, mx, my, a, data)
+        go_right = right < current
+        go_left = ~go_right & (left < current)
+        x = np.where(go_right, x + delta, np.where(go_left, x - delta, x))
+        delta = np.where(go_right, delta * 1.1, np.where(go_left, delta * -1.1, delta * .5))
+        return x, delta
+
+
+    def batch_move_attenuation(self, rx, cx, rm, cm, a, delta):
+        # The twiddle_a() rule, applied to every candidate at once
+        current = np.sum(self.batch_slice_errors(rx, cx, rm, cm, a, self.data), 1)
+        right = np.sum(self.batch_slice_errors(rx, cx, rm, cm, a + delta, self.data), 1)
+        left = np.sum(self.batch_slice_errors(rx, cx, rm, cm, a - delta, self.data), 1)
+        go_right = right < current
+        go_left = ~go_right & (left < current)
+        a = np.where(go_right, a + delta, np.where(go_left, a - delta, a))
+        delta = np.where(go_left, -(delta + .0001), delta + .0001)
+        return a, delta
+
+
+    def batch_solve_multipliers(self, rx, cx, rm, cm, a):
+        # solve_multipliers() for every candidate at once
+        kernel = 2**(-(np.absolute(rx[:, :, None] - cx[:, None, :])**a[:, None, None]))
+        rm = self.optimal_multipliers(self.data_squared, kernel * cm[:, None, :], rm)
+        cm = self.optimal_multipliers(self.data_squared.T, kernel.transpose(0, 2, 1) * rm[:, None, :], cm)
+        return rm, cm
 
 
     def save_solution(self):
@@ -148,31 +298,207 @@ class FrequencyTableSolver():
        self.rx, self.cx, self.rm, self.cm, self.a = solution
 
 
-    def evaluate(self, hint=''):
-        # Chi-square against zero correlation model
-        t1 = time.time()
-        one_dimensional_distances = np.absolute(np.subtract.outer(self.rx, self.cx))
-        t2 = time.time()
-        products_of_multipliers = (np.outer(self.rm, self.cm))
-        t3 = time.time()
-        self.fitted_frequencies = products_of_multipliers * 2**(-(one_dimensional_distances**self.a))
-        t4 = time.time()
-        # try exp
-        #error np.sum(
-        error = np.sum(((self.data - self.fitted_frequencies)**2) / self.fitted_frequencies)
-        t5 = time.time()
-        #print(f'eval tot (us):{1e6*(t5-t1):.3f} t2:{1e6*(t2-t1):.3f} t3:{1e6*(t3-t2):.3f} t4:{1e6*(t4-t3):.3f} t5:{1e6*(t5-t4):.3f}')
+    # Evaluation workspace
+    #
+    # evaluate() runs thousands of times per second, so it works in scratch buffers
+    # that are sized once per job instead of allocating temporaries on every call.
+
+    def allocate_workspace(self):
+        self.nrow, self.ncol = np.shape(self.data)
+        self.data64 = np.asarray(self.data, dtype=np.float64)       # for reporting, see evaluate_float64()
+        self.data = self.data64.astype(self.dtype, copy=False)
+        self.data_squared = self.data**2
+        shape, dtype = (self.nrow, self.ncol), self.dtype
+        self.fitted_frequencies = np.empty(shape, dtype)
+        self.cell_errors = np.empty(shape, dtype)
+        self.trial_fitted = np.empty(shape, dtype)                  # full-table trials, swapped in on commit
+        self.trial_cells = np.empty(shape, dtype)
+        self.row_fitted = np.empty(self.ncol, dtype)                # single row trials
+        self.row_cells = np.empty(self.ncol, dtype)
+        self.column_fitted = np.empty(self.nrow, dtype)             # single column trials
+        self.column_cells = np.empty(self.nrow, dtype)
+        self.log_distances = np.empty(shape, dtype)                 # attenuation cache
+        self.products_of_multipliers = np.empty(shape, dtype)
+        self.attenuation_cache_key = None
+        k = len(self.line_offsets)                                  # line search trials
+        self.line_row_fitted = np.empty((k, self.ncol), dtype)
+        self.line_row_cells = np.empty((k, self.ncol), dtype)
+        self.line_column_fitted = np.empty((k, self.nrow), dtype)
+        self.line_column_cells = np.empty((k, self.nrow), dtype)
+        self.last_valid_solution = None
+        self.cached_error = None
+        self.trial = None
+
+
+    def evaluate_into(self, fitted, cells):
+        # Chi-square against zero correlation model, computed in place.  This is the
+        # same sequence of operations as the plain expression
+        #     fitted = np.outer(rm, cm) * 2**(-(np.absolute(np.subtract.outer(rx, cx))**a))
+        #     np.sum(((data - fitted)**2) / fitted)
+        # (including numpy's fast paths for ** with a scalar), so it agrees bit for bit.
+        np.subtract.outer(self.rx, self.cx, out=fitted)
+        np.absolute(fitted, out=fitted)
+        fitted **= self.a
+        np.negative(fitted, out=fitted)
+        np.power(2, fitted, out=fitted)
+        np.multiply.outer(self.rm, self.cm, out=cells)
+        np.multiply(cells, fitted, out=fitted)
+        np.subtract(self.data, fitted, out=cells)
+        np.square(cells, out=cells)
+        np.divide(cells, fitted, out=cells)
+        return np.sum(cells)
+
+
+    def evaluate_slice_into(self, x, y, m, my, data, fitted, cells):
+        # One row (or column) of evaluate_into(): coordinate x and multiplier m against
+        # the coordinates y and multipliers my along the other axis
+        np.subtract(x, y, out=fitted)
+        np.absolute(fitted, out=fitted)
+        fitted **= self.a
+        np.negative(fitted, out=fitted)
+        np.power(2, fitted, out=fitted)
+        np.multiply(m, my, out=cells)
+        np.multiply(cells, fitted, out=fitted)
+        np.subtract(data, fitted, out=cells)
+        np.square(cells, out=cells)
+        np.divide(cells, fitted, out=cells)
+        return np.sum(cells)
+
+
+    def evaluate_float64(self):
+        # The error as reported to the outside world: a full re-evaluation in float64,
+        # whatever the working precision, returned as a plain float
+        rx, cx, rm, cm = (np.asarray(v, dtype=np.float64) for v in (self.rx, self.cx, self.rm, self.cm))
+        fitted = np.outer(rm, cm) * 2**(-(np.absolute(np.subtract.outer(rx, cx))**self.a))
+        return float(np.sum(((self.data64 - fitted)**2) / fitted))
+
+
+    def cast_solution(self):
+        # Keep the solution arrays in the working precision (a stays a python float)
+        self.rx, self.cx, self.rm, self.cm = (np.asarray(v, dtype=self.dtype) for v in (self.rx, self.cx, self.rm, self.cm))
+
+
+    def validate(self):
+        # Periodic stand-in for trapping every floating-point error: remember the last
+        # solution that checked out, and fall back to it if the solver ever wanders off
+        valid = (np.isfinite(self.minimum_error) and np.isfinite(self.a) and self.a > 0
+            and all(np.all(np.isfinite(v)) for v in (self.rx, self.cx, self.rm, self.cm))
+            and np.all(self.rm > 0) and np.all(self.cm > 0))
+        if valid:
+            self.last_valid_solution = tuple(np.copy(v) for v in (self.rx, self.cx, self.rm, self.cm)) + (self.a,)
+        elif self.last_valid_solution is not None:
+            print(f'validation failed at error {self.minimum_error}: restoring last valid solution')
+            self.restore_solution(tuple(np.copy(v) for v in self.last_valid_solution[:4]) + self.last_valid_solution[4:])
+            self.initialize_deltas()
+            self.minimum_error = self.evaluate()
+        else:
+            raise FloatingPointError(f'Solver produced an invalid solution: error={self.minimum_error}')
+
+
+    def evaluate(self):
+        # A full evaluation also resynchronizes the incremental caches below
+        t_start = time.perf_counter()
+        error = self.evaluate_into(self.fitted_frequencies, self.cell_errors)
+        self.cached_error = error
+        self.commits_since_resync = 0
+        self.trial = None
+        self.evaluate_histogram.observe(time.perf_counter() - t_start)
+        return error
+
+
+    # Incremental evaluation
+    #
+    # fitted_frequencies and cell_errors always describe the committed solution.
+    # A trial move of rx[i] or rm[i] only changes row i, and a move of cx[j] or cm[j]
+    # only changes column j, so the trial error is the cached error with that one
+    # slice swapped out.  commit_trial() writes the slice into the cache; a rejected
+    # trial is simply dropped, which leaves the cache as it was.
+
+    def evaluate_trial(self, kind, i):
+        if not self.incremental or self.cached_error is None:
+            return self.evaluate_full_trial(kind, i)
+
+        if kind == 'a':
+            if self.a <= 0: return self.evaluate_full_trial(kind, i)
+            self.update_attenuation_cache()
+            error = self.evaluate_attenuation_into(self.a, self.trial_fitted, self.trial_cells)
+            self.trial = (kind, i, self.trial_fitted, self.trial_cells, error)
+            return error
+
+        if kind == 'rx' or kind == 'rm':
+            fitted, cells = self.row_fitted, self.row_cells
+            trial_error = self.evaluate_slice_into(self.rx[i], self.cx, self.rm[i], self.cm, self.data[i], fitted, cells)
+            error = self.cached_error - np.sum(self.cell_errors[i]) + trial_error
+        else:
+            fitted, cells = self.column_fitted, self.column_cells
+            trial_error = self.evaluate_slice_into(self.cx[i], self.rx, self.cm[i], self.rm, self.data[:, i], fitted, cells)
+            error = self.cached_error - np.sum(self.cell_errors[:, i]) + trial_error
+        self.trial = (kind, i, fitted, cells, error)
+        return error
+
+
+    def evaluate_full_trial(self, kind, i):
+        # Moves that touch every cell (attenuation), or a solver with the incremental
+        # engine turned off: evaluate the whole table but keep it aside until committed
+        error = self.evaluate_into(self.trial_fitted, self.trial_cells)
+        self.trial = (kind, i, self.trial_fitted, self.trial_cells, error)
         return error
 
 
-    def evaluate_with_hint(self, hint=''):
-        # Chi-square against zero correlation model
-        if self.one_dimensional_distances is None or hint == 'rx' or hint == 'cx':
-            self.one_dimensional_distances = np.absolute(np.subtract.outer(self.rx, self.cx))
-        if self.products_of_multipliers is None or hint == 'rm' or hint == 'cm':
-            self.products_of_multipliers = (np.outer(self.rm, self.cm))
-        self.fitted_frequencies = self.products_of_multipliers * 2**(-(self.one_dimensional_distances**self.a))
-        return np.sum(((self.data - self.fitted_frequencies)**2) / self.fitted_frequencies)
+    # Attenuation cache
+    #
+    # A move of a changes every cell but nothing else, so while the coordinates and
+    # multipliers stay put we keep log|rx-cx| and outer(rm, cm), and a trial value
+    # of a costs fitted = products * 2**(-exp(a * log_distances)) with no general power.
+    # Exactly-zero distances are stored as log(0) = -inf, so exp(-inf) = 0 = 0**a for a > 0.
+    # The cache remembers the arrays it was built from and rebuilds when any of them moved.
+
+    def update_attenuation_cache(self):
+        key = self.attenuation_cache_key
+        if key is not None and all(np.array_equal(cached, current) for cached, current in zip(key, (self.rx, self.cx, self.rm, self.cm))):
+            return
+        log_distances = self.log_distances
+        np.subtract.outer(self.rx, self.cx, out=log_distances)
+        np.absolute(log_distances, out=log_distances)
+        positive = log_distances > 0
+        np.log(log_distances, out=log_distances, where=positive)
+        log_distances[~positive] = -np.inf
+        np.multiply.outer(self.rm, self.cm, out=self.products_of_multipliers)
+        self.attenuation_cache_key = (self.rx.copy(), self.cx.copy(), self.rm.copy(), self.cm.copy())
+
+
+    def evaluate_attenuation_into(self, a, fitted, cells):
+        # evaluate_into() for the cached coordinates and multipliers and attenuation a;
+        # agrees with it to within a few ulps per cell
+        np.multiply(self.log_distances, a, out=fitted)
+        np.exp(fitted, out=fitted)
+        np.negative(fitted, out=fitted)
+        np.exp2(fitted, out=fitted)
+        np.multiply(self.products_of_multipliers, fitted, out=fitted)
+        np.subtract(self.data, fitted, out=cells)
+        np.square(cells, out=cells)
+        np.divide(cells, fitted, out=cells)
+        return np.sum(cells)
+
+
+    def commit_trial(self):
+        kind, i, fitted, cells, error = self.trial
+        self.trial = None
+        if fitted.ndim == 2:
+            self.fitted_frequencies, self.trial_fitted = self.trial_fitted, self.fitted_frequencies
+            self.cell_errors, self.trial_cells = self.trial_cells, self.cell_errors
+        elif kind == 'rx' or kind == 'rm':
+            self.fitted_frequencies[i] = fitted
+            self.cell_errors[i] = cells
+        else:
+            self.fitted_frequencies[:, i] = fitted
+            self.cell_errors[:, i] = cells
+        self.cached_error = error
+
+        # the running total drifts slightly with every swapped slice; resync it now and then
+        self.commits_since_resync += 1
+        if self.commits_since_resync >= self.resync_interval:
+            self.minimum_error = self.evaluate()
 
 
     # Solver optimization implementation
@@ -185,6 +511,14 @@ class FrequencyTableSolver():
         param_cx = [(self.twiddle_column_coordinate, i, 'cx') for i in range(self.ncol)]    # column ccoordinate i
         param_cm = [(self.twiddle_column_multiplier, i, 'cm') for i in range(self.ncol)]    # column multiplier i
         param_a  = [(self.twiddle_a, 0, 'a')]                                               # attenuation and two dummy values
+        if self.search == 'line':
+            param_rx = [(self.line_search_row_coordinate, i, 'rx') for i in range(self.nrow)]
+            param_rm = [(self.line_search_row_multiplier, i, 'rm') for i in range(self.nrow)]
+            param_cx = [(self.line_search_column_coordinate, i, 'cx') for i in range(self.ncol)]
+            param_cm = [(self.line_search_column_multiplier, i, 'cm') for i in range(self.ncol)]
+            param_a  = [(self.line_search_a, 0, 'a')]
+        if self.exact_multipliers:
+            param_rm = param_cm = []                                                        # see solve_multipliers()
         self.parameters = param_rx + param_rm + param_cx + param_cm + param_a
 
 
@@ -193,21 +527,34 @@ class FrequencyTableSolver():
         random.shuffle(self.parameters)
 
 
+    def accepts(self, error):
+        # Metropolis acceptance: an improvement is always taken; at a temperature above zero a
+        # worse trial is taken with probability exp(-increase / (temperature * error)), so the
+        # temperature is a relative error increase and means the same thing on any table
+        accepted = error < self.minimum_error or (self.temperature > 0 and np.isfinite(error)
+            and random.random() < math.exp((self.minimum_error - error) / (self.temperature * self.minimum_error)))
+        if accepted: self.accepted += 1
+        else: self.rejected += 1
+        return accepted
+
+
     # Methods to step each parameter type down the goodness-of-fit gradient
 
     def twiddle_row_multiplier(self, i):
         t1 = time.time()
         rm = self.rm[i]
         self.rm[i] *= self.rm_delta[i]
-        right_error = self.evaluate(hint='rm')
-        if right_error < self.minimum_error:
+        right_error = self.evaluate_trial('rm', i)
+        if self.accepts(right_error):
             self.minimum_error = right_error
+            self.commit_trial()
             self.rm_delta[i] *= 1.01
         else:
             self.rm[i] = rm / self.rm_delta[i]
-            left_error = self.evaluate(hint='rm')
-            if left_error < self.minimum_error:
+            left_error = self.evaluate_trial('rm', i)
+            if self.accepts(left_error):
                 self.minimum_error = left_error
+                self.commit_trial()
                 self.rm_delta[i] /= 1.01    
             else:
                 self.rm[i] = rm
@@ -218,15 +565,17 @@ class FrequencyTableSolver():
     def twiddle_column_multiplier(self, i):
         cm = self.cm[i]
         self.cm[i] *= self.cm_delta[i]
-        right_error = self.evaluate(hint='cm')
-        if right_error < self.minimum_error:
+        right_error = self.evaluate_trial('cm', i)
+        if self.accepts(right_error):
             self.minimum_error = right_error
+            self.commit_trial()
             self.cm_delta[i] *= 1.01        
         else:
             self.cm[i] = cm / self.cm_delta[i]
-            left_error = self.evaluate(hint='cm')
-            if left_error < self.minimum_error:
+            left_error = self.evaluate_trial('cm', i)
+            if self.accepts(left_error):
                 self.minimum_error = left_error
+                self.commit_trial()
                 self.cm_delta[i] /= 1.01
             else:
                 self.cm[i] = cm
@@ -236,15 +585,17 @@ class FrequencyTableSolver():
     def twiddle_row_coordinate(self, i):
         rx = self.rx[i]
         self.rx[i] += self.rx_delta[i]
-        right_error = self.evaluate(hint='rx')
-        if right_error < self.minimum_error:
+        right_error = self.evaluate_trial('rx', i)
+        if self.accepts(right_error):
             self.minimum_error = right_error
+            self.commit_trial()
             self.rx_delta[i] *= 1.1
         else:
             self.rx[i] = rx - self.rx_delta[i]
-            left_error = self.evaluate(hint='rx')
-            if left_error < self.minimum_error:
+            left_error = self.evaluate_trial('rx', i)
+            if self.accepts(left_error):
                 self.minimum_error = left_error
+                self.commit_trial()
                 self.rx_delta[i] *= -1.1
             else:
                 self.rx[i] = rx
@@ -254,15 +605,17 @@ class FrequencyTableSolver():
     def twiddle_column_coordinate(self, i):
         cx = self.cx[i]
         self.cx[i] += self.cx_delta[i]
-        right_error = self.evaluate(hint='cx')
-        if right_error < self.minimum_error:
+        right_error = self.evaluate_trial('cx', i)
+        if self.accepts(right_error):
             self.minimum_error = right_error
+            self.commit_trial()
             self.cx_delta[i] *= 1.1        
         else:
             self.cx[i] = cx - self.cx_delta[i]
-            left_error = self.evaluate(hint='cx')
-            if left_error < self.minimum_error:
+            left_error = self.evaluate_trial('cx', i)
+            if self.accepts(left_error):
                 self.minimum_error = left_error
+                self.commit_trial()
                 self.cx_delta[i] *= -1.1
             else:
                 self.cx[i] = cx
@@ -272,15 +625,17 @@ class FrequencyTableSolver():
     def twiddle_a(self, i):
         a = self.a
         self.a += self.a_delta
-        right_error = self.evaluate(hint='a')
-        if right_error < self.minimum_error:
+        right_error = self.evaluate_trial('a', i)
+        if self.accepts(right_error):
             self.minimum_error = right_error
+            self.commit_trial()
             self.a_delta += .0001       
         else:
             self.a = a - self.a_delta
-            left_error = self.evaluate(hint='a')
-            if left_error < self.minimum_error:
+            left_error = self.evaluate_trial('a', i)
+            if self.accepts(left_error):
                 self.minimum_error = left_error
+                self.commit_trial()
                 self.a_delta = - (self.a_delta +.0001)  
             else:
                 self.a = a
@@ -288,24 +643,261 @@ class FrequencyTableSolver():
         #return(('a', i, self.a, self.a_delta))
 
 
+    # Vectorized line search
+    #
+    # Instead of trying x+delta and x-delta and adapting delta by fixed factors, try
+    # x + delta*line_offsets (or m * delta**line_offsets for a multiplier) all at once.
+    # A row move only changes that row, so the K trials are one K x ncol broadcast;
+    # likewise K x nrow for a column.  The best trial is taken if it improves, and
+    # delta becomes the size of the step that worked, or shrinks to the smallest
+    # offset tried if none did.
+
+    def line_search_row_coordinate(self, i):
+        self.line_search_slice('rx', i)
+
+    def line_search_row_multiplier(self, i):
+        self.line_search_slice('rm', i)
+
+    def line_search_column_coordinate(self, i):
+        self.line_search_slice('cx', i)
+
+    def line_search_column_multiplier(self, i):
+        self.line_search_slice('cm', i)
+
+
+    def line_search_slice(self, kind, i):
+        if self.cached_error is None: self.minimum_error = self.evaluate()
+        if kind == 'rx' or kind == 'rm':
+            x, y, m, my = self.rx, self.cx, self.rm, self.cm
+            deltas = self.rx_delta if kind == 'rx' else self.rm_delta
+            data, current = self.data[i], self.cell_errors[i]
+            fitted, cells = self.line_row_fitted, self.line_row_cells
+        else:
+            x, y, m, my = self.cx, self.rx, self.cm, self.rm
+            deltas = self.cx_delta if kind == 'cx' else self.cm_delta
+            data, current = self.data[:, i], self.cell_errors[:, i]
+            fitted, cells = self.line_column_fitted, self.line_column_cells
+
+        k = len(self.line_offsets)
+        if kind == 'rx' or kind == 'cx':
+            xs = x[i] + abs(deltas[i]) * self.line_offsets
+            ms = np.full(k, m[i])
+        else:
+            xs = np.full(k, x[i])
+            ms = m[i] * deltas[i]**self.line_offsets
+
+        # evaluate_slice_into(), broadcast over the K trials.  The outer trials can land
+        # far from the current solution; any that under- or overflow just score inf or nan
+        with np.errstate(all='ignore'):
+            np.subtract.outer(xs, y, out=fitted)
+            np.absolute(fitted, out=fitted)
+            fitted **= self.a
+            np.negative(fitted, out=fitted)
+            np.power(2, fitted, out=fitted)
+            np.multiply.outer(ms, my, out=cells)
+            np.multiply(cells, fitted, out=fitted)
+            np.subtract(data, fitted, out=cells)
+            np.square(cells, out=cells)
+            np.divide(cells, fitted, out=cells)
+            errors = np.sum(cells, 1)
+        errors = self.cached_error - np.sum(current) + errors
+        errors[np.isnan(errors)] = np.inf
+
+        if kind == 'rx' or kind == 'cx':
+            best = self.accept_line_trial(kind, i, x, xs, errors)
+            deltas[i] = abs(deltas[i]) * abs(self.line_offsets[best]) if best is not None else abs(deltas[i]) * self.line_shrink
+        else:
+            best = self.accept_line_trial(kind, i, m, ms, errors)
+            deltas[i] = deltas[i]**abs(self.line_offsets[best]) if best is not None else deltas[i]**self.line_shrink
+
+
+    def line_search_a(self, i):
+        # Every cell depends on a, so a K x nrow x ncol tensor could get large; instead
+        # the trial values run one after another through the cached attenuation kernel
+        if self.cached_error is None: self.minimum_error = self.evaluate()
+        if not self.incremental or self.a <= 0: return self.twiddle_a(i)
+        self.update_attenuation_cache()
+        trials = self.a + abs(self.a_delta) * self.line_offsets
+        errors = np.full(len(trials), np.inf)
+        with np.errstate(all='ignore'):
+            for k, a in enumerate(trials):
+                if a > 0:
+                    errors[k] = self.evaluate_attenuation_into(a, self.trial_fitted, self.trial_cells)
+        errors[np.isnan(errors)] = np.inf
+
+        best = self.accept_line_trial('a', i, None, trials, errors)
+        self.a_delta = abs(self.a_delta) * (abs(self.line_offsets[best]) if best is not None else self.line_shrink)
+
+
+    def accept_line_trial(self, kind, i, values, trials, errors):
+        # Take the best improving trial, re-scored through the incremental trial path so that
+        # it can be committed; an inf or nan score is never taken.  Returns its index, or None
+        # if nothing was taken
+        for best in np.argsort(errors):
+            if not self.accepts(errors[best]): break
+            previous = self.a if values is None else values[i]
+            if values is None: self.a = float(trials[best])
+            else: values[i] = trials[best]
+            error = self.evaluate_trial(kind, i)
+            if error < self.minimum_error or (self.temperature > 0 and np.isfinite(error)):
+                self.minimum_error = error
+                self.commit_trial()
+                return best
+            if values is None: self.a = previous
+            else: values[i] = previous
+        return None
+
+
+    # Analytic-gradient engine
+    #
+    # The parameter vector is [rx, cx, log(rm), log(cm), a]; working with the log of the
+    # multipliers keeps them positive without constraints.  With f = rm*cm*2**(-d**a),
+    # d = |rx-cx| and chi = sum((data-f)**2/f), the derivative with respect to each
+    # fitted frequency is 1 - data**2/f**2, and every parameter's gradient is a row or
+    # column sum of that matrix times the derivative of f, so one pass yields them all.
+
+    def get_parameter_vector(self):
+        return np.concatenate((self.rx, self.cx, np.log(self.rm), np.log(self.cm), [self.a]))
+
+
+    def set_parameter_vector(self, theta):
+        n, m = self.nrow, self.ncol
+        self.rx = theta[:n].copy()
+        self.cx = theta[n:n+m].copy()
+        self.rm = np.exp(theta[n+m:2*n+m])
+        self.cm = np.exp(theta[2*n+m:2*n+2*m])
+        self.a = float(theta[-1])
+
+
+    def gradient(self):
+        # Returns (error, gradient with respect to the parameter vector)
+        differences = np.subtract.outer(self.rx, self.cx)
+        distances = np.absolute(differences)
+        powered = distances**self.a
+        fitted = np.outer(self.rm, self.cm) * 2**(-powered)
+        error = np.sum(((self.data - fitted)**2) / fitted)
+
+        g = fitted - self.data_squared / fitted             # dchi/df * f
+        nonzero = distances > 0
+        d_distance = np.zeros_like(distances)           # d(d**a)/dd = a * d**(a-1), zero where d == 0
+        np.divide(self.a * powered, distances, out=d_distance, where=nonzero)
+        log_distance = np.zeros_like(distances)
+        np.log(distances, out=log_distance, where=nonzero)
+
+        h = -np.log(2) * g * d_distance * np.sign(differences)
+        grad_a = -np.log(2) * np.sum(g * powered * log_distance)
+        return error, np.concatenate((h.sum(1), -h.sum(0), g.sum(1), g.sum(0), [grad_a]))
+
+
+    def reset_lbfgs(self):
+        self.lbfgs_theta = None
+        self.lbfgs_gradient = None
+        self.lbfgs_memory = []
+
+
+    def lbfgs_direction(self, grad):
+        # Standard two-loop recursion over the stored (s, y) curvature pairs
+        q = grad.copy()
+        alphas = []
+        for s, y in reversed(self.lbfgs_memory):
+            alpha = np.dot(s, q) / np.dot(y, s)
+            q -= alpha * y
+            alphas.append(alpha)
+        if self.lbfgs_memory:
+            s, y = self.lbfgs_memory[-1]
+            q *= np.dot(s, y) / np.dot(y, y)
+        else:
+            q /= max(1.0, np.linalg.norm(grad))         # first step: unit-length steepest descent
+        for (s, y), alpha in zip(self.lbfgs_memory, reversed(alphas)):
+            beta = np.dot(y, q) / np.dot(y, s)
+            q += (alpha - beta) * s
+        return -q
+
+
+    def try_parameter_vector(self, theta):
+        # Error and gradient at theta, or (inf, None) for points outside the model's domain
+        if theta[-1] <= 0: return np.inf, None
+        self.set_parameter_vector(theta)
+        error, grad = self.gradient()
+        if not np.isfinite(error): return np.inf, None
+        return error, grad
+
+
+    def sweep_lbfgs(self):
+        theta = self.get_parameter_vector()
+
+        # the curvature history is only valid if nobody else moved the solution since our last step
+        if self.lbfgs_theta is None or not np.array_equal(theta, self.lbfgs_theta):
+            self.reset_lbfgs()
+            error, grad = self.gradient()
+        else:
+            error, grad = self.minimum_error, self.lbfgs_gradient
+
+        direction = self.lbfgs_direction(grad)
+        slope = np.dot(grad, direction)
+        if slope >= 0:                                  # not a descent direction: fall back to the gradient
+            self.reset_lbfgs()
+            direction = self.lbfgs_direction(grad)
+            slope = np.dot(grad, direction)
+
+        # backtracking line search with the Armijo sufficient-decrease condition
+        step = 1.0
+        for attempt in range(30):
+            new_theta = theta + step * direction
+            new_error, new_grad = self.try_parameter_vector(new_theta)
+            if new_error <= error + 1e-4 * step * slope:
+                break
+            step *= .5
+        else:
+            self.set_parameter_vector(theta)
+            self.reset_lbfgs()
+            self.minimum_error = self.evaluate()
+            return
+
+        s, y = new_theta - theta, new_grad - grad
+        if np.dot(s, y) > 1e-10:
+            self.lbfgs_memory.append((s, y))
+            self.lbfgs_memory = self.lbfgs_memory[-self.lbfgs_memory_size:]
+        self.minimum_error = self.evaluate()
+        self.lbfgs_theta = self.get_parameter_vector()
+        self.lbfgs_gradient = new_grad
+
+
     def initialize_deltas(self):
-        self.rx_delta = np.zeros_like(self.rx) + .1
-        self.cx_delta = np.zeros_like(self.cx) + .1
-        self.rm_delta = np.ones_like(self.rm) * 1.1
-        self.cm_delta = np.ones_like(self.cm) * 1.1
+        self.rx_delta = np.zeros_like(self.rx) + self.coordinate_step
+        self.cx_delta = np.zeros_like(self.cx) + self.coordinate_step
+        self.rm_delta = np.ones_like(self.rm) * self.multiplier_step
+        self.cm_delta = np.ones_like(self.cm) * self.multiplier_step
         self.a_delta = .001
 
 
     def update_solution(self, msg):
         print(f'update solution: {msg}')
-        self.rx = np.array(msg['solution']['rx'])
-        self.cx = np.array(msg['solution']['cx'])
-        self.rm = np.array(msg['solution']['rm'])
-        self.cm = np.array(msg['solution']['cm'])
-        self.a = msg['solution']['a']
+        self.adopt_solution(msg['solution'])
+
+
+    def adopt_solution(self, solution):
+        # solution is in solution_dict() form
+        self.rx = np.array(solution['rx'])
+        self.cx = np.array(solution['cx'])
+        self.rm = np.array(solution['rm'])
+        self.cm = np.array(solution['cm'])
+        self.a = solution['a']
+        self.error_list = []
         self.evaluate()
 
 
+    def solution_dict(self):
+        # The solution as sent over the wire; the inverse of update_solution()
+        return {
+            'rx': self.rx.tolist(),
+            'cx': self.cx.tolist(),
+            'rm': self.rm.tolist(),
+            'cm': self.cm.tolist(),
+            'a': float(self.a)
+        }
+
+
     def perturb_array(self, array, proportion):
         perturbation = array * (np.random.random(len(array)) - .5) * proportion
         print(f'perturbing: {array} {perturbation}')
@@ -319,26 +911,98 @@ class FrequencyTableSolver():
         self.rm = self.perturb_array(self.rm, msg['proportion'])
         self.cm = self.perturb_array(self.cm, msg['proportion'])
         self.a  = self.perturb_array([self.a], msg['proportion'])[0]
+        self.error_list = []
         self.evaluate()
 
 
+    # Closed-form multipliers
+    #
+    # With the coordinates and attenuation fixed, row i's fit is rm[i] * c[i,j] where
+    # c = cm * 2**(-|rx-cx|**a), so its chi-square is
+    #     sum(data**2 / c) / rm[i] - 2 * sum(data) + rm[i] * sum(c)
+    # which is minimized exactly at rm[i] = sqrt(sum(data**2 / c) / sum(c)).
+    # The same holds for each cm[j] with the roles of rows and columns swapped.
+
+    def optimal_multipliers(self, data_squared, partial_fit, current):
+        numerator = np.sum(data_squared / partial_fit, -1)
+        denominator = np.sum(partial_fit, -1)
+        # an all-zero row or column would be driven to zero; leave its multiplier alone
+        positive = numerator > 0
+        optimal = current.copy()
+        optimal[positive] = np.sqrt(numerator[positive] / denominator[positive])
+        return optimal
+
+
+    def solve_multipliers(self):
+        kernel = 2**(-(np.absolute(np.subtract.outer(self.rx, self.cx))**self.a))
+        self.rm = self.optimal_multipliers(self.data_squared, kernel * self.cm, self.rm)
+        self.cm = self.optimal_multipliers(self.data_squared.T, kernel.T * self.rm, self.cm)
+
+
+    # Block-parallel (Jacobi) sweep
+    #
+    # Given the columns, each row's error depends only on its own coordinate and
+    # multiplier, so moves for every row can be proposed, scored and accepted together,
+    # and likewise for the columns.  The batch_* helpers from the multi-start do the
+    # work with a batch of one, and the multipliers are solved in closed form.
+    # As a safeguard against joint overshoot the full error is re-checked after each
+    # block; a block that made things worse is rolled back with its step sizes halved.
+
+    def sweep_jacobi(self):
+        self.solve_multipliers()
+        self.minimum_error = self.evaluate()
+        self.jacobi_block('rx')
+        self.jacobi_block('cx')
+        self.twiddle_a(0)
+
+
+    def jacobi_block(self, kind):
+        before = self.minimum_error
+        x, x_delta = getattr(self, kind), getattr(self, kind + '_delta')
+        a = np.array([self.a])
+        if kind == 'rx':
+            moved, delta = self.batch_move_coordinates(self.rx[None], self.cx[None], self.rm[None], self.cm[None], a, self.data, self.rx_delta[None])
+        else:
+            moved, delta = self.batch_move_coordinates(self.cx[None], self.rx[None], self.cm[None], self.rm[None], a, self.data.T, self.cx_delta[None])
+        setattr(self, kind, moved[0])
+        setattr(self, kind + '_delta', delta[0])
+        error = self.evaluate()         # nan compares false, and is rolled back like inf
+        if error <= before:
+            self.minimum_error = error
+        else:
+            setattr(self, kind, x)
+            setattr(self, kind + '_delta', x_delta * .5)
+            self.minimum_error = self.evaluate()
+
+
+    def sweep_twiddle(self):
+        if self.exact_multipliers:
+            self.solve_multipliers()
+            self.minimum_error = self.evaluate()
+        self.update_parameter_list()
+        for parameter in self.parameters:
+            parameter[0](parameter[1])      # call the parameter stepping function
+
+
     def solve(self, iterations=1):
         #print('Solving...', iterations)
         self.t_solve_start = time.time()
         #cutoff_ratio = .999995
 
         #random.seed()
+        self.cast_solution()
         self.initialize_deltas()
-        self.error_list = []
+        sweep = self.engines[self.engine]
         for self.iteration in range(iterations):
             self.t_start = time.time()
             last_error = self.minimum_error = self.evaluate()
-            self.update_parameter_list()
-            for parameter in self.parameters:
-                parameter[0](parameter[1])      # call the parameter stepping function
-            self.error_list.append([self.iteration, self.minimum_error])
+            sweep()
+            self.error_list.append([self.iterations_solved + self.iteration + 1, self.minimum_error])
+            if (self.iteration + 1) % self.validate_interval == 0:
+                self.validate()
             self.t_end = time.time()
-            if self.iteration and (self.iteration % 1000) == 0:
+            self.sweep_histogram.observe(self.t_end - self.t_start)
+            if self.verbose and self.iteration and (self.iteration % 1000) == 0:
                 self.show_state(f'Iteration: {self.iteration} dt:{self.t_end-self.t_start:.4f}')
                 if last_error != None and self.iteration != 0:
                     ratio = self.minimum_error / last_error
@@ -346,15 +1010,80 @@ class FrequencyTableSolver():
                     #if ratio > cutoff_ratio: break
                     last_error = self.minimum_error
 
+        self.validate()
         self.t_solve_end = time.time()
+        self.batch_iterations = iterations
+        self.iterations_solved += iterations
+        self.seconds_solved += self.t_solve_end - self.t_solve_start
+        del self.error_list[:-(self.convergence_window + 1)]
         return (self.minimum_error, self.save_solution())
 
 
+    def metrics(self):
+        # Running totals for metrics.py, small enough to go with every error report
+        return {
+            'iterations': self.iterations_solved,
+            'seconds': self.seconds_solved,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'evaluate': self.evaluate_histogram.snapshot(),
+            'sweep': self.sweep_histogram.snapshot()
+        }
+
+
+    # Batches and convergence
+    #
+    # Callers that solve in batches (swarm_bot.py, solverpool.py) size each batch with
+    # next_batch(), so that it takes about batch_seconds whatever the size of the table, and
+    # stop spending time on a solution once converged() says more batches won't help.
+
+    def next_batch(self, iterations):
+        # iterations for the next solve(), at the pace of the last one; growth is limited to
+        # doubling so one quick batch doesn't make the next one run long.  iterations is the
+        # size of the first batch, and of every batch if batch_seconds is 0.
+        if not self.batch_seconds or self.batch_iterations is None: return iterations
+        pace = self.batch_iterations / max(self.t_solve_end - self.t_solve_start, 1e-6)
+        return int(max(1, min(self.batch_seconds * pace, 2 * self.batch_iterations)))
+
+
+    def deltas_collapsed(self):
+        # every step size the engine probes with ended the last batch below delta_tolerance of
+        # where solve() starts it (the multipliers' relative to 1).  The attenuation's step
+        # never shrinks, see twiddle_a(); lbfgs takes its steps from the gradient.
+        if self.engine == 'lbfgs': return True
+        steps = [self.rx_delta / self.coordinate_step, self.cx_delta / self.coordinate_step]
+        if not self.exact_multipliers:
+            log_step = np.log(self.multiplier_step)
+            steps += [np.log(np.abs(self.rm_delta)) / log_step, np.log(np.abs(self.cm_delta)) / log_step]
+        return all(np.max(np.abs(step)) < self.delta_tolerance for step in steps)
+
+
+    def converged(self):
+        # no more than convergence_ratio relative improvement over the last convergence_window
+        # iterations of error_list, with the step sizes collapsed.  A solver at a temperature
+        # above zero wanders by design and never converges.
+        if self.temperature > 0 or len(self.error_list) <= self.convergence_window: return False
+        start_error, latest_error = self.error_list[0][1], self.error_list[-1][1]
+        return start_error - latest_error <= self.convergence_ratio * start_error and self.deltas_collapsed()
+
+
 
 if __name__ == "__main__":
 
-    solver = FrequencyTableSolver()
-    solver.read_csv_data("degree by family income_6x12.csv")
+    import argparse
+    parser = argparse.ArgumentParser('python3 frequencytablesolver.py')
+    parser.add_argument('--input_file', default='data/degree by family income_6x12.csv')
+    parser.add_argument('--engine', default='twiddle', choices=['twiddle', 'lbfgs', 'jacobi'])
+    parser.add_argument('--multipliers', default='exact', choices=['exact', 'twiddle'])
+    parser.add_argument('--search', default='twiddle', choices=['twiddle', 'line'])
+    parser.add_argument('--precision', default='float64', choices=['float64', 'float32'])
+    parser.add_argument('--temperature', default=0, type=float, help='relative error increase accepted with probability 1/e')
+    args = parser.parse_args()
+
+    solver = FrequencyTableSolver(engine=args.engine, multipliers=args.multipliers, search=args.search, precision=args.precision)
+    solver.temperature = args.temperature
+    solver.verbose = True
+    solver.read_csv_data(args.input_file)
     solver.initialize_starting_point()
     solver.show_state('STARTING POINT SOLUTION')
 
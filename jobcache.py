@@ -0,0 +1,53 @@
+# Content-addressed cache of job data on the bot's disk
+#
+# A job is identified by job_hash(): sha256 over its shape, labels and data.  Bots list the
+# hashes they have when they join, and the boss only sends the job data itself when the bot
+# doesn't already have it.  Several bots on one machine can share one cache directory.
+
+import hashlib
+import json
+import os
+import numpy as np
+
+
+def job_hash(job_data):
+    # job_data is the (nrow, ncol, column_labels, row_labels, data) tuple
+    nrow, ncol, column_labels, row_labels, data = job_data
+    h = hashlib.sha256()
+    h.update(json.dumps([nrow, ncol, list(column_labels), list(row_labels)]).encode('utf-8'))
+    h.update(np.ascontiguousarray(data, dtype='<f8').tobytes())
+    return h.hexdigest()
+
+
+class JobCache():
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, hash):
+        return os.path.join(self.directory, hash + '.json')
+
+    def hashes(self):
+        return [f[:-len('.json')] for f in os.listdir(self.directory) if f.endswith('.json')]
+
+    def load(self, hash):
+        # Returns (filename, job_data), or (None, None) if we don't have it or it doesn't check out
+        try:
+            with open(self.path(hash), 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None, None
+        job_data = tuple(saved['job_data'])
+        if job_hash(job_data) != hash:
+            return None, None
+        return saved['filename'], job_data
+
+    def store(self, hash, filename, job_data):
+        nrow, ncol, column_labels, row_labels, data = job_data
+        saved = {'filename': filename, 'job_data': [nrow, ncol, list(column_labels), list(row_labels), np.asarray(data).tolist()]}
+        # write then rename, so another bot never reads a partial file
+        temporary = self.path(hash) + f'.{os.getpid()}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(saved, f)
+        os.replace(temporary, self.path(hash))
@@ -0,0 +1,88 @@
+# Solver instrumentation and the boss's /metrics page
+#
+# Each FrequencyTableSolver times its full evaluations and its sweeps into Histograms and
+# counts accepted and rejected trials.  Bots send a snapshot of those totals with their error
+# reports (merged over the workers, for a pool); the boss keeps each bot's latest snapshot,
+# works out its iterations per second from the last two, and serves the lot in Prometheus
+# text format on /metrics, and as a summary to the console.
+#
+# Snapshots hold running totals rather than changes since the last report, so a lost message
+# costs nothing, and a bot's numbers just start over when it reconnects.
+
+import bisect
+import math
+
+
+class Histogram():
+    # Observations (seconds) counted in log-spaced buckets, 1us to 10s, as Prometheus wants
+    # them: cheap to keep, a short list of counts to send, and easy to add up across bots
+    BOUNDS = [1e-6 * 10**(k/2) for k in range(15)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)      # the last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.sum += value
+
+    def snapshot(self):
+        return {'counts': list(self.counts), 'sum': self.sum}
+
+
+def merge(snapshots):
+    # Add up solver snapshots (FrequencyTableSolver.metrics()), e.g. over a pool's workers
+    merged = None
+    for snapshot in snapshots:
+        if snapshot is None: continue
+        if merged is None:
+            merged = {key: dict(value, counts=list(value['counts'])) if isinstance(value, dict) else value for key, value in snapshot.items()}
+            continue
+        for key, value in snapshot.items():
+            if isinstance(value, dict):
+                merged[key]['counts'] = [a + b for a, b in zip(merged[key]['counts'], value['counts'])]
+                merged[key]['sum'] += value['sum']
+            else:
+                merged[key] += value
+    return merged
+
+
+def mean(histogram):
+    count = sum(histogram['counts'])
+    return histogram['sum'] / count if count else None
+
+
+def label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(**values):
+    return '{' + ','.join(f'{key}="{label_value(value)}"' for key, value in values.items()) + '}' if values else ''
+
+
+class Exposition():
+    # Prometheus text format, one metric family at a time.  The metric's name is 'metric',
+    # leaving 'name' free for a label
+
+    def __init__(self):
+        self.lines = []
+
+    def family(self, metric, kind, help):
+        self.lines.append(f'# HELP {metric} {help}')
+        self.lines.append(f'# TYPE {metric} {kind}')
+
+    def sample(self, metric, value, **label_values):
+        if value is None or (isinstance(value, float) and not math.isfinite(value)): return
+        self.lines.append(f'{metric}{labels(**label_values)} {value}')
+
+    def histogram(self, metric, histogram, **label_values):
+        cumulative = 0
+        for bound, count in zip(Histogram.BOUNDS + ['+Inf'], histogram['counts']):
+            cumulative += count
+            le = bound if bound == '+Inf' else f'{bound:.3g}'
+            self.sample(metric + '_bucket', cumulative, **label_values, le=le)
+        self.sample(metric + '_sum', histogram['sum'], **label_values)
+        self.sample(metric + '_count', cumulative, **label_values)
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
@@ -0,0 +1,125 @@
+# Shared-memory state for solvers on the same host
+#
+# SharedJobData publishes the job's data table once per host; every local solver maps it
+# read-only instead of keeping its own copy.  SharedBestSolution is a single "current
+# best" slot that local solvers offer their solutions to and poll between batches, so a
+# good solution spreads across the host without waiting for the boss's broadcast.
+
+#
+# The segments are created and unlinked by the process that owns the pool.  Workers are
+# spawned from it and share its resource tracker, which also cleans the segments up if
+# the owner dies without unlinking them.
+
+from multiprocessing import shared_memory
+import numpy as np
+
+
+class SharedJobData():
+
+    def __init__(self, nrow, ncol, data=None, name=None):
+        self.nrow, self.ncol = nrow, ncol
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=max(1, 8 * nrow * ncol))
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+        self.data = np.ndarray((nrow, ncol), dtype=np.float64, buffer=self.shm.buf)
+        if data is not None:
+            self.data[:] = data
+        if not self.owner:
+            self.data.flags.writeable = False
+
+    @classmethod
+    def publish(cls, job_data):
+        # job_data is the (nrow, ncol, column_labels, row_labels, data) tuple sent by the boss
+        nrow, ncol = job_data[0], job_data[1]
+        return cls(nrow, ncol, data=np.asarray(job_data[4], dtype=np.float64))
+
+    def describe(self, job_data):
+        # What a worker needs to attach: the job tuple with the data replaced by the segment name
+        return {'nrow': self.nrow, 'ncol': self.ncol, 'column_labels': job_data[2], 'row_labels': job_data[3], 'name': self.name}
+
+    @classmethod
+    def attach(cls, description):
+        return cls(description['nrow'], description['ncol'], name=description['name'])
+
+    def job_data(self, description):
+        # The (nrow, ncol, column_labels, row_labels, data) tuple, with data mapped in place
+        return (self.nrow, self.ncol, description['column_labels'], description['row_labels'], self.data)
+
+    def close(self):
+        self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class SharedBestSolution():
+
+    # Layout, all float64: [version, error, a] then rx, cx, rm, cm.  Step sizes aren't kept:
+    # a solver that adopts the solution starts its own afresh.
+    # version is a seqlock counter: odd while a writer is mid-update, bumped to the next
+    # even value when it is done.  Readers retry if it changed under them.  Writers also
+    # hold a multiprocessing lock so that two solvers never write at once.
+    HEADER = 3
+
+    def __init__(self, nrow, ncol, lock, name=None):
+        self.nrow, self.ncol = nrow, ncol
+        self.lock = lock
+        size = 8 * (self.HEADER + 2 * nrow + 2 * ncol)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+        self.slot = np.ndarray((size // 8,), dtype=np.float64, buffer=self.shm.buf)
+        if self.owner:
+            self.slot[:] = 0
+            self.slot[1] = np.inf           # nothing offered yet
+
+        n, m, h = nrow, ncol, self.HEADER
+        offsets = np.cumsum([h, n, m, n, m])
+        self.arrays = [self.slot[offsets[k]:offsets[k + 1]] for k in range(4)]
+
+    def version(self):
+        return int(self.slot[0])
+
+    def error(self):
+        return float(self.slot[1])
+
+    def offer(self, error, solution):
+        # Store solution (a solution_dict()-style mapping) if it beats the one in the slot
+        if not error < self.slot[1]: return False
+        with self.lock:
+            if not error < self.slot[1]: return False
+            self.slot[0] += 1
+            self.slot[1] = error
+            self.slot[2] = solution['a']
+            for array, value in zip(self.arrays, (solution['rx'], solution['cx'], solution['rm'], solution['cm'])):
+                array[:] = value
+            self.slot[0] += 1
+        return True
+
+    def read(self):
+        # Returns (version, error, solution) with solution in solution_dict() form,
+        # or (version, inf, None) if nothing has been offered yet
+        while True:
+            version = self.slot[0]
+            if version % 2 == 1: continue
+            error = float(self.slot[1])
+            if error == np.inf: return int(version), error, None
+            copies = [array.copy() for array in self.arrays]
+            solution = {'rx': copies[0], 'cx': copies[1], 'rm': copies[2], 'cm': copies[3], 'a': float(self.slot[2])}
+            if self.slot[0] == version:
+                return int(version), error, solution
+
+    def close(self):
+        self.slot = None
+        self.arrays = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
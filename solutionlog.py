@@ -0,0 +1,175 @@
+# Append-only solution log with an offset index
+#
+# The log itself is unchanged: one JSON solution record per line in output/<name>.json, so jq
+# and tail still work on it.  Next to it, output/<name>.json.idx holds one fixed-size binary
+# record per line: the line's byte offset, its error and time, and the index of the best
+# solution logged so far.  That makes reading entry i, the best solution, or the last n
+# entries constant time, however long the log.  An index that is missing or behind the log
+# (older logs, or a crash between the two writes) is brought up to date on open.
+#
+#   python3 solutionlog.py 'output/degree by family income_6x12.json' best --field=error
+#   python3 solutionlog.py 'output/degree by family income_6x12.json' get -1
+#   python3 solutionlog.py 'output/degree by family income_6x12.json' tail 5 --field=solution.a
+#   python3 solutionlog.py 'output/Senate_Votes 115-v2.json' errors | sparkline
+
+import argparse
+import json
+import os
+import numpy as np
+
+INDEX_RECORD = np.dtype([('offset', '<u8'), ('error', '<f8'), ('time', '<f8'), ('best', '<u8')])
+
+
+class SolutionLog():
+
+    def __init__(self, file_name, writer=False):
+        # writer: this is the process that appends to the log (the boss), so a partial line at
+        # its end is left over from a crash rather than a write in progress
+        self.file_name = file_name
+        self.writer = writer
+        self.index_file_name = file_name + '.idx'
+        self.update_index()
+
+    def __len__(self):
+        return os.path.getsize(self.index_file_name) // INDEX_RECORD.itemsize if os.path.exists(self.index_file_name) else 0
+
+    def index_record(self, index):
+        with open(self.index_file_name, 'rb') as f:
+            f.seek(index * INDEX_RECORD.itemsize)
+            return np.frombuffer(f.read(INDEX_RECORD.itemsize), dtype=INDEX_RECORD)[0]
+
+    def index_records(self, start=0, stop=None):
+        # the index as a structured array, mapped rather than read, for scans over big logs
+        n = len(self)
+        start, stop, step = slice(start, stop).indices(n)
+        if start >= stop: return np.empty(0, dtype=INDEX_RECORD)
+        return np.memmap(self.index_file_name, dtype=INDEX_RECORD, mode='r', shape=(n,))[start:stop]
+
+    def update_index(self):
+        # index any lines that the index doesn't cover yet.  Whatever a crash left half-written,
+        # a partial index record or (for the writer) a partial line at the end of the log, is cut
+        # off: appends would otherwise land straight after it, and read back as garbage.
+        if not os.path.exists(self.file_name): return
+        n = len(self)
+        if os.path.exists(self.index_file_name) and os.path.getsize(self.index_file_name) != n * INDEX_RECORD.itemsize:
+            os.truncate(self.index_file_name, n * INDEX_RECORD.itemsize)
+        if n > 0 and self.index_record(n - 1)['offset'] >= os.path.getsize(self.file_name):
+            # the log was truncated or replaced; start over
+            os.remove(self.index_file_name)
+            n = 0
+        if n > 0:
+            last = self.index_record(n - 1)
+            with open(self.file_name, 'rb') as f:
+                f.seek(int(last['offset']))
+                f.readline()
+                offset = f.tell()
+            best_index, best_error = int(last['best']), float(self.index_record(int(last['best']))['error'])
+        else:
+            offset, best_index, best_error = 0, None, None
+        if offset >= os.path.getsize(self.file_name): return
+
+        with open(self.file_name, 'rb') as f, open(self.index_file_name, 'ab') as index:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'): break     # a write in progress, or torn by a crash
+                if line.strip():
+                    record = json.loads(line)
+                    best_index, best_error = self.write_index_record(index, n, offset, record, best_index, best_error)
+                    n += 1
+                offset += len(line)
+        if self.writer and offset < os.path.getsize(self.file_name):
+            os.truncate(self.file_name, offset)
+
+    def write_index_record(self, index, n, offset, record, best_index, best_error):
+        error = record['error']
+        if best_error is None or error < best_error:
+            best_index, best_error = n, error
+        entry = np.array([(offset, error, record.get('time', 0), best_index)], dtype=INDEX_RECORD)
+        index.write(entry.tobytes())
+        return best_index, best_error
+
+    def append(self, record):
+        n = len(self)
+        if n > 0:
+            last = self.index_record(n - 1)
+            best_index, best_error = int(last['best']), float(self.index_record(int(last['best']))['error'])
+        else:
+            best_index, best_error = None, None
+        line = (json.dumps(record) + '\n').encode('utf-8')
+        with open(self.file_name, 'ab') as f:
+            offset = f.tell()
+            f.write(line)
+        with open(self.index_file_name, 'ab') as index:
+            self.write_index_record(index, n, offset, record, best_index, best_error)
+
+    def read(self, index):
+        # entry index, counting from the end if negative, like a list
+        n = len(self)
+        if not -n <= index < n:
+            raise IndexError(f'{self.file_name} has {n} solutions, no index {index}')
+        with open(self.file_name, 'rb') as f:
+            f.seek(int(self.index_record(index % n)['offset']))
+            return json.loads(f.readline())
+
+    def best_index(self):
+        n = len(self)
+        return int(self.index_record(n - 1)['best']) if n else None
+
+    def best(self):
+        return self.read(self.best_index()) if len(self) else None
+
+    def tail(self, count):
+        n = len(self)
+        return [self.read(index) for index in range(max(0, n - count), n)]
+
+
+def field(record, path):
+    # 'solution.rx.0' -> record['solution']['rx'][0]
+    for key in path.split('.'):
+        record = record[int(key)] if isinstance(record, list) else record[key]
+    return record
+
+
+def show(record, path):
+    print(json.dumps(field(record, path) if path else record))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser('python3 solutionlog.py')
+    parser.add_argument('log', help='solution log, e.g. output/<name>.json')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('count', help='number of solutions logged')
+    best = subparsers.add_parser('best', help='the lowest-error solution')
+    best.add_argument('--field', default='', help="print just this, e.g. 'error' or 'solution.a'")
+    get = subparsers.add_parser('get', help='solution by index; negative counts from the end')
+    get.add_argument('index', type=int)
+    get.add_argument('--field', default='')
+    tail = subparsers.add_parser('tail', help='the last n solutions')
+    tail.add_argument('count', type=int, nargs='?', default=10)
+    tail.add_argument('--field', default='')
+    errors = subparsers.add_parser('errors', help='every error, one per line, from the index alone')
+    errors.add_argument('--best', action='store_true', help='best error so far rather than each error')
+    values = subparsers.add_parser('values', help="one field of every solution, e.g. 'solution.rx.0'")
+    values.add_argument('field')
+    args = parser.parse_args()
+
+    log = SolutionLog(args.log)
+    if args.command == 'count':
+        print(len(log))
+    elif args.command == 'best':
+        show(log.best(), args.field)
+    elif args.command == 'get':
+        show(log.read(args.index), args.field)
+    elif args.command == 'tail':
+        for record in log.tail(args.count):
+            show(record, args.field)
+    elif args.command == 'errors':
+        records = log.index_records()
+        for error in (records['error'][records['best']] if args.best else records['error']):
+            print(repr(float(error)))
+    elif args.command == 'values':
+        with open(args.log, 'r') as f:
+            for line in f:
+                if line.strip():
+                    show(json.loads(line), args.field)
@@ -0,0 +1,230 @@
+# Pool of solver processes on one host, driven by a single SwarmBot
+#
+# The bot keeps the one socket.io connection to the boss.  Each worker process owns a
+# FrequencyTableSolver and runs batches of iterations; the bot fans commands out to the
+# workers, collects their results, and only forwards the best local solution to the boss.
+#
+# The job's data table and the pool's best solution live in shared memory (sharedstate.py):
+# workers map the table rather than each holding a copy, offer improvements to the shared
+# best slot after every batch, and adopt whatever is in it when it beats their own solution.
+#
+# Given a ladder of temperatures, the workers run as replicas for parallel tempering
+# (tempering.py): only those at temperature 0 adopt the shared best, and exchange() trades
+# temperatures between neighbours on their latest errors.
+#
+# Each worker sizes its batches by the solver's batch_seconds (FrequencyTableSolver.next_batch())
+# and says with each result whether its solution has converged; see converged().
+
+import multiprocessing as mp
+import queue
+import random
+import numpy as np
+from frequencytablesolver import FrequencyTableSolver
+from metrics import merge
+from sharedstate import SharedBestSolution, SharedJobData
+from tempering import exchange
+
+
+def solver_worker(index, options, settings, iterations, commands, results, best_lock, temperature):
+    # Runs in its own process; commands are (cmd, msg) tuples mirroring the boss's commands
+    random.seed()
+    np.random.seed()
+    solver = FrequencyTableSolver(**options)
+    for name, value in settings.items():
+        setattr(solver, name, value)        # batch_seconds, convergence_window, ...
+    solver.temperature = temperature
+    running = False
+    generation = None       # which job the results belong to
+    job_data = best = None  # shared memory for the current job
+    best_version = None     # last version of the shared best slot we looked at
+
+    while True:
+        # handle everything queued up; block while there is nothing to solve
+        while True:
+            try:
+                cmd, msg = commands.get(block=not running)
+            except queue.Empty:
+                break
+
+            if cmd == 'update_job_data':
+                # msg describes the shared segments; the solver reads the mapped table in place
+                if job_data is not None:
+                    solver.data = solver.data64 = None
+                    job_data.close()
+                    best.close()
+                generation = msg['generation']
+                job_data = SharedJobData.attach(msg['job_data'])
+                best = SharedBestSolution(job_data.nrow, job_data.ncol, best_lock, name=msg['best'])
+                best_version = None
+                solver.update_job_data(job_data.job_data(msg['job_data']))
+                solver.initialize_parameter_list()
+                # a new job (the bot skips repeats of the one it has); the boss follows up
+                # with its best solution or a random start
+                solver.get_random_starting_point()
+                solver.minimum_error = None
+                running = True
+
+            elif cmd == 'random_start':
+                solver.initialize_starting_point()
+                running = True
+
+            elif cmd == 'perturb':
+                solver.perturb_solution(msg)
+
+            elif cmd == 'temperature':
+                solver.temperature = msg
+
+            elif cmd == 'run':
+                running = True
+
+            elif cmd == 'stop':
+                running = False
+
+            elif cmd == 'quit':
+                return
+
+        if not mp.parent_process().is_alive(): return
+        solver.solve(iterations=solver.next_batch(iterations))
+        error = solver.evaluate_float64()
+        best.offer(error, solver.solution_dict())
+
+        # between batches, pick up a better solution found by another worker or sent by the boss;
+        # hotter workers keep to their own, or the ladder would collapse onto the best
+        if solver.temperature == 0 and best.version() != best_version and best.error() < error:
+            best_version, best_error, solution = best.read()
+            if solution is not None and best_error < error:
+                solver.adopt_solution(solution)
+        results.put((index, generation, error, solver.batch_iterations, solver.t_solve_end - solver.t_solve_start, solver.converged(), solver.metrics()))
+
+
+class SolverPool():
+
+    def __init__(self, workers, options, iterations, temperatures=(0,), settings={}):
+        # spawn rather than fork: the bot process already has socket.io threads running
+        context = mp.get_context('spawn')
+        self.results = context.Queue()
+        self.commands = [context.Queue() for worker in range(workers)]
+        self.best_lock = context.Lock()
+        self.temperatures = [temperatures[index % len(temperatures)] for index in range(workers)]
+        self.exchange_round = 0
+        self.processes = [
+            context.Process(target=solver_worker, args=(index, options, settings, iterations, self.commands[index], self.results, self.best_lock, self.temperatures[index]), daemon=True)
+            for index in range(workers)
+        ]
+        for process in self.processes:
+            process.start()
+        self.errors = [None] * workers
+        self.worker_converged = [False] * workers
+        self.worker_metrics = [None] * workers     # each worker's latest solver.metrics()
+        self.iterations = 0
+        self.seconds = 0
+        self.generation = 0
+        self.job_data = None        # SharedJobData for the current job
+        self.best = None            # SharedBestSolution for the current job
+        self.best_version = None
+        self.best_error = None
+
+
+    def update_job_data(self, job_data):
+        # Publish the table and a fresh best slot, then point the workers at them.
+        # Results still in flight for the previous job are dropped by collect().
+        self.release()
+        self.generation += 1
+        self.errors = [None] * len(self.processes)
+        self.worker_converged = [False] * len(self.processes)
+        self.job_data = SharedJobData.publish(job_data)
+        self.best = SharedBestSolution(self.job_data.nrow, self.job_data.ncol, self.best_lock)
+        self.best_version = None
+        self.best_error = None
+        self.broadcast('update_job_data', {
+            'job_data': self.job_data.describe(job_data),
+            'best': self.best.name,
+            'generation': self.generation
+        })
+
+
+    def local_job_data(self, job_data):
+        # The job tuple for a solver in this process, reading the shared table in place
+        return self.job_data.job_data(self.job_data.describe(job_data))
+
+
+    def offer(self, error, solution):
+        # Put a solution from outside the pool (the boss's best) where the workers will see it
+        if self.best is None: return False
+        return self.best.offer(error, solution)
+
+
+    def best_solution(self):
+        # (error, solution) from the shared slot, or (None, None) before anything was offered
+        if self.best is None: return None, None
+        version, error, solution = self.best.read()
+        if solution is None: return None, None
+        return error, solution
+
+
+    def broadcast(self, cmd, msg=None):
+        for commands in self.commands:
+            commands.put((cmd, msg))
+
+
+    def collect(self):
+        # Drain finished batches; returns True if the pool's best solution improved
+        improved = False
+        while True:
+            try:
+                index, generation, error, iterations, seconds, converged, metrics = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.worker_metrics[index] = metrics
+            if generation != self.generation: continue
+            self.errors[index] = error
+            self.worker_converged[index] = converged
+            self.iterations += iterations
+            self.seconds += seconds
+        if self.best is not None and self.best.version() != self.best_version:
+            self.best_version = self.best.version()
+            improved = self.best_error is None or self.best.error() < self.best_error
+            self.best_error = self.best.error() if self.best.error() < np.inf else None
+        return improved
+
+
+    def metrics(self):
+        # the workers' solver metrics, added up
+        return merge(self.worker_metrics)
+
+
+    def converged(self):
+        # every worker's latest batch found its solution converged
+        return all(self.worker_converged)
+
+
+    def exchange(self):
+        # Replica exchange between workers at neighbouring temperatures, on the errors of their
+        # latest batches; returns the number of swaps
+        errors = [error for error in self.errors if error is not None]
+        if len(set(self.temperatures)) < 2 or not errors: return 0
+        replicas = {index: (self.temperatures[index], self.errors[index]) for index in range(len(self.processes))}
+        moves = exchange(replicas, min(errors), self.exchange_round)
+        self.exchange_round += 1
+        for index, temperature in moves.items():
+            self.temperatures[index] = temperature
+            self.errors[index] = None       # until it reports at the new temperature
+            self.commands[index].put(('temperature', temperature))
+        return len(moves) // 2
+
+
+    def release(self):
+        # Workers map the segments by name; unlinking only removes the name, so they can
+        # finish their current batch before switching to the next job
+        if self.job_data is not None:
+            self.job_data.close()
+            self.best.close()
+            self.job_data = self.best = None
+
+
+    def terminate(self):
+        self.broadcast('quit')
+        for process in self.processes:
+            process.join(timeout=2)
+            if process.is_alive(): process.terminate()
+        self.release()
@@ -1,26 +1,22 @@
 # Swarm solver boss
 
-from adjustText import adjust_text
 import argparse
 from datetime import datetime
-from flask import Flask, Response, redirect, render_template, request, session, send_file
+from flask import Flask, Response, redirect, render_template, request, session
 from flask_socketio import Namespace, SocketIO, join_room, leave_room, rooms
+import hashlib
 import json
 import multiprocessing as mp
-import numpy as np
 import os
-import random
 from subprocess import DEVNULL, Popen
 import sys
 import threading
 import time
 import traceback
-
-# use matplotlib without gui
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.ticker as plticker
+from werkzeug.utils import secure_filename
+from metrics import Exposition, mean, merge
+from swarmjob import EXPLORER_ROLES, SwarmJob, allocate_bots
+from wireformat import PROTOCOLS, decode_command, encode_command
 
 class BossIO(Namespace):
 
@@ -29,9 +25,8 @@ class BossIO(Namespace):
         boss.handle_connect()
 
     def on_disconnect(self):
-        pass
-        #global boss
-        #boss.handle_disconect()
+        global boss
+        boss.handle_disconnect()
     
     def on_command(self, msg):
         global boss
@@ -56,61 +51,68 @@ class SwarmBoss():
         self.app.config['SECRET_KEY'] = 'secret-sauce!'
         self.app.route('/')(self.serve_index)
         self.app.route('/chart')(self.serve_chart)
+        self.app.route('/solution')(self.serve_solution)
+        self.app.route('/jobs', methods=['GET', 'POST'])(self.serve_jobs)
+        self.app.route('/metrics')(self.serve_metrics)
         self.socketio = SocketIO(self.app, always_connect=True)
         self.socketio.on_namespace(BossIO('/'))
 
-        self.job_data = self.read_csv_data(args.input_file)
-        print(f'job_data: {self.job_data}')
-        self.solution = None
-        self.solutions = []
-        self.best_error = None
-        self.last_best_error = None
+        self.jobs = {}              # job id -> SwarmJob, in the order they were added
+        self.bots = {}              # sid -> {'name', 'protocol', 'jobs': hashes it has cached, 'job': id, 'metrics'}
+        self.bots_lock = threading.Lock()
         self.last_update_time = time.time()
-        self.chart_number = 0
-
-        if args.resume:
-            self.load_last_solution()
+        self.last_schedule_time = time.time()
+        self.last_strategy_time = time.time()
+        self.last_exchange_time = time.time()
+        for input_file in args.input_file or ['data/degree by family income_6x12.csv']:
+            self.add_job(input_file, resume=args.resume)
 
         self.workers = []
         if args.workers > 0:
             self.start_workers(args.workers)
 
 
-    # initialize data
-    def read_csv_data(self, file_name):
-        self.input_file_name = file_name
-        print(f'loading file: {file_name}')
-        with open(file_name, 'r') as infile:
-            text = infile.read()
-        lines = text.split('\n')                    # split file in to lines separated by the invisible character \r
-        lines = [line.split(',') for line in lines] # convert each line to a list of its column values
-        input_as_array = np.array(lines)            # convert to np array format
-        self.column_labels = input_as_array[0,1:]   # first column of array (from second row to end)
-        self.row_labels = input_as_array[1:,0]      # first row of array (from second column to endd)
-        self.data = input_as_array[1:, 1:]
-        self.data[self.data==''] = 0.0
-        self.data = self.data.astype("float")
-        self.nrow, self.ncol = np.shape(self.data)
-        return (self.nrow, self.ncol, self.column_labels.tolist(), self.row_labels.tolist(), self.data.tolist())
-
-
-    def load_last_solution(self):
-        solution_data_file = 'output/' + self.input_file_name.split('/')[-1].replace('.csv', '.json')
-        print(f'resuming from solution in {solution_data_file}')
-        with open(solution_data_file, 'r') as f:
-            lines = f.read().strip().split('\n')
-        saved_data = json.loads(lines[self.args.resume_index])
-        print(f'resuming from solution: index={self.args.resume_index} data={saved_data}')
-        self.solution = saved_data
-        self.solution['time'] = time.time()
-        self.solutions.append(self.solution)
-        self.best_error = saved_data['error']
+    # jobs
+    def add_job(self, file_name, resume=False):
+        # Returns the job for file_name, adding it unless the same table is already being solved
+        job = SwarmJob(file_name, self.socketio, self.args)
+        if job.id in self.jobs:
+            print(f'already solving {job.name} as {self.jobs[job.id].input_file_name}')
+            return self.jobs[job.id]
+        job.start()
+        if resume and len(job.solution_log()):
+            job.load_last_solution(self.args.resume_index)
+        print(f'added job {job.id}: {job.name} ({job.nrow} X {job.ncol})')
+        self.jobs[job.id] = job
+        return job
+
+
+    def message_job(self, msg):
+        # The job a bot's message is about: the one it names, or the one the bot is working on
+        job_hash = msg.get('job_hash')
+        if job_hash is not None:
+            job = self.jobs.get(job_hash[:12])
+            return job if job is not None and job.job_hash == job_hash else None
+        bot = self.bots.get(request.sid)
+        return self.jobs.get(bot['job']) if bot else None
+
+
+    def request_job(self):
+        # the job named by ?job=..., or the first one
+        job_id = request.args.get('job')
+        if job_id:
+            return self.jobs.get(job_id)
+        return next(iter(self.jobs.values()), None)
 
 
     def start_workers(self, num_workers):
         command = [
-            'python3', self.args.swarm_worker
+            'python3', self.args.swarm_worker, f'--url=http://localhost:{self.args.port}'
         ]
+        if self.args.pool:
+            # one bot process with one connection, driving num_workers solver processes
+            self.workers.append(Popen(command + [f'--pool={num_workers}'], stdout=DEVNULL, stderr=DEVNULL))
+            return
         for worker in range(num_workers):
             self.workers.append(Popen(command, stdout=DEVNULL, stderr=DEVNULL))
             #self.workers.append(Popen(command))
@@ -121,8 +123,159 @@ class SwarmBoss():
 
 
     def serve_chart(self):
-        print(f'serve_chart: {self.chart_file_name}')
-        return send_file('output/' + self.chart_file_name, mimetype='image/png')
+        job = self.request_job()
+        if job is None or job.chart_png is None:
+            return Response('no chart yet', status=404)
+        # browsers re-request /chart?id=... on every update; don't resend an unchanged chart
+        if job.chart_etag in request.if_none_match:
+            return Response(status=304)
+        response = Response(job.chart_png, mimetype='image/png')
+        response.set_etag(job.chart_etag)
+        return response
+
+
+    def serve_solution(self):
+        job = self.request_job()
+        if job is None:
+            return Response('no such job', status=404)
+        return Response(json.dumps(job.live_state()), mimetype='application/json')
+
+
+    def serve_jobs(self):
+        # GET: the jobs and how they are doing; POST: add the CSV file in 'file' as a new job
+        if request.method == 'POST':
+            upload = request.files.get('file')
+            if upload is None or not upload.filename:
+                return Response('no file', status=400)
+            contents = upload.read()
+            name = secure_filename(upload.filename) or 'job.csv'
+            if not name.endswith('.csv'): name += '.csv'
+            file_name = os.path.join('jobs', name)
+            if os.path.exists(file_name):
+                with open(file_name, 'rb') as f:
+                    if f.read() != contents:
+                        # a different table under the same name; keep both
+                        file_name = file_name.replace('.csv', f'-{hashlib.sha256(contents).hexdigest()[:8]}.csv')
+            os.makedirs('jobs', exist_ok=True)
+            with open(file_name, 'wb') as f:
+                f.write(contents)
+            try:
+                job = self.add_job(file_name, resume=self.args.resume)
+            except ValueError as e:
+                self.remove_job_file(file_name)
+                return Response(f'not a table: {e}', status=400)
+            if job.input_file_name != file_name:
+                self.remove_job_file(file_name)     # a copy of a job we already have
+            self.socketio.emit('jobs', self.job_summaries(), room='console')
+            return Response(json.dumps(job.summary()), mimetype='application/json')
+        return Response(json.dumps(self.job_summaries()), mimetype='application/json')
+
+
+    def remove_job_file(self, file_name):
+        # an uploaded table we aren't keeping, and its csvtable cache
+        for name in (file_name, file_name + '.cache.npy', file_name + '.cache.json'):
+            if os.path.exists(name):
+                os.remove(name)
+
+
+    def job_summaries(self):
+        return [job.summary() for job in list(self.jobs.values())]
+
+
+    # metrics (see metrics.py)
+    def record_metrics(self, sid, msg):
+        # Keep the solver metrics that came with a bot's report, and its iterations per second
+        # since the one before
+        snapshot = msg.pop('metrics', None)
+        if not snapshot: return
+        now = time.time()
+        with self.bots_lock:
+            bot = self.bots.get(sid)
+            if bot is None: return
+            last = bot.get('metrics')
+            rate = last['rate'] if last else None
+            if last and now > last['time'] and snapshot['iterations'] >= last['snapshot']['iterations']:
+                rate = (snapshot['iterations'] - last['snapshot']['iterations']) / (now - last['time'])
+            bot['metrics'] = {'time': now, 'snapshot': snapshot, 'rate': rate}
+
+
+    def bot_metrics(self):
+        # One summary per bot that has reported metrics
+        now = time.time()
+        with self.bots_lock:
+            bots = [(bot['name'], self.jobs.get(bot['job']), bot['pool'], bot['metrics']) for bot in self.bots.values() if bot.get('metrics')]
+        summaries = []
+        for name, job, pool, metrics in bots:
+            snapshot = metrics['snapshot']
+            trials = snapshot['accepted'] + snapshot['rejected']
+            summaries.append({
+                'name': name,
+                'job': job.id if job else None,
+                'job_name': job.name if job else None,
+                'pool': pool,
+                'iterations': snapshot['iterations'],
+                'iterations_per_second': metrics['rate'],
+                'sweep_seconds': mean(snapshot['sweep']),
+                'evaluate_seconds': mean(snapshot['evaluate']),
+                'acceptance': snapshot['accepted'] / trials if trials else None,
+                'age': now - metrics['time'],
+                'snapshot': snapshot
+            })
+        return summaries
+
+
+    def console_metrics(self):
+        # What the console shows: cluster throughput, and each bot's, to spot stragglers
+        summaries = self.bot_metrics()
+        return {
+            'iterations_per_second': sum(bot['iterations_per_second'] or 0 for bot in summaries),
+            'bots': {bot['name']: {key: bot[key] for key in ('job', 'iterations_per_second', 'sweep_seconds', 'acceptance', 'age')} for bot in summaries}
+        }
+
+
+    def serve_metrics(self):
+        # Prometheus text format: the jobs, each bot, and latency histograms over all the bots
+        summaries = self.bot_metrics()
+        out = Exposition()
+        jobs = list(self.jobs.values())
+        out.family('swarm_bots', 'gauge', 'Connected bots')
+        out.sample('swarm_bots', len(self.bots))
+        out.family('swarm_job_bots', 'gauge', 'Bots working on each job')
+        for job in jobs:
+            out.sample('swarm_job_bots', len(job.bots), job=job.id, name=job.name)
+        out.family('swarm_job_best_error', 'gauge', 'Best error found for each job')
+        for job in jobs:
+            out.sample('swarm_job_best_error', job.best_error, job=job.id, name=job.name)
+        out.family('swarm_job_solutions_total', 'counter', 'New best solutions for each job')
+        for job in jobs:
+            out.sample('swarm_job_solutions_total', len(job.solutions), job=job.id, name=job.name)
+
+        out.family('swarm_iterations_per_second', 'gauge', 'Solver iterations per second over all bots')
+        out.sample('swarm_iterations_per_second', sum(bot['iterations_per_second'] or 0 for bot in summaries))
+        out.family('swarm_bot_iterations_total', 'counter', 'Solver iterations (sweeps over every parameter) by each bot')
+        for bot in summaries:
+            out.sample('swarm_bot_iterations_total', bot['iterations'], bot=bot['name'], job=bot['job_name'])
+        out.family('swarm_bot_iterations_per_second', 'gauge', 'Solver iterations per second by each bot, between its last two reports')
+        for bot in summaries:
+            out.sample('swarm_bot_iterations_per_second', bot['iterations_per_second'], bot=bot['name'], job=bot['job_name'])
+        out.family('swarm_bot_solve_seconds_total', 'counter', 'Seconds each bot has spent solving')
+        for bot in summaries:
+            out.sample('swarm_bot_solve_seconds_total', bot['snapshot']['seconds'], bot=bot['name'], job=bot['job_name'])
+        out.family('swarm_bot_trials_total', 'counter', 'Trial moves accepted and rejected by each bot')
+        for bot in summaries:
+            for result in ('accepted', 'rejected'):
+                out.sample('swarm_bot_trials_total', bot['snapshot'][result], bot=bot['name'], job=bot['job_name'], result=result)
+        out.family('swarm_bot_report_age_seconds', 'gauge', 'Seconds since each bot last reported')
+        for bot in summaries:
+            out.sample('swarm_bot_report_age_seconds', round(bot['age'], 3), bot=bot['name'], job=bot['job_name'])
+
+        merged = merge(bot['snapshot'] for bot in summaries)
+        if merged:
+            out.family('swarm_evaluate_seconds', 'histogram', 'Full evaluations of the error, over all bots')
+            out.histogram('swarm_evaluate_seconds', merged['evaluate'])
+            out.family('swarm_sweep_seconds', 'histogram', 'Solver iterations, over all bots')
+            out.histogram('swarm_sweep_seconds', merged['sweep'])
+        return Response(out.text(), mimetype='text/plain; version=0.0.4')
 
 
     # socket event handlers
@@ -131,48 +284,85 @@ class SwarmBoss():
         print(datetime.now(), 'connect::', request.sid)
 
 
+    def handle_disconnect(self):
+        with self.bots_lock:
+            bot = self.bots.pop(request.sid, None)
+            if bot and bot['job'] in self.jobs:
+                self.jobs[bot['job']].remove_bot(request.sid)
+
+
     def handle_command(self, msg):
         try:
+            decode_command(msg, as_lists=True)
 
             if msg['cmd'] == 'join':
                 print(f'join command: {msg}, sid={request.sid}')
                 if self.args.kill_bots:
                     self.socketio.emit('command', {'cmd': 'quit'}, room=request.sid)
                     return
-                self.socketio.emit('command', {'cmd': 'update_job_data', 'filename': self.input_file_name, 'job_data': self.job_data}, room=request.sid)
-                if self.solution is not None:
-                    self.socketio.emit('command', {'cmd': 'update_solution', 'error': self.best_error, 'solution': self.solution}, room=request.sid)
-                else:
-                    self.socketio.emit('command', {'cmd': 'random_start'}, room=request.sid)
+                # bots name their wire format; anything we don't know gets the original JSON one
+                protocol = msg.get('bot') if msg.get('bot') in PROTOCOLS else 'v1'
+                with self.bots_lock:
+                    bot = self.bots.setdefault(request.sid, {'name': msg.get('name'), 'protocol': protocol, 'pool': msg.get('pool', 0), 'job': None})
+                    # bots list the jobs they have cached; only send the data to those that don't have it
+                    bot['jobs'] = set(msg.get('jobs', []))
+                    job = self.jobs.get(bot['job'])
+                self.assign(request.sid, job or self.schedule_bot())
+
+            elif msg['cmd'] == 'iam':
+                # a web console; it gets solution updates in JSON
+                join_room('console')
 
             elif msg['cmd'] == 'error':
+                self.record_metrics(request.sid, msg)
                 print('command:', msg)
-                print(f'error: best_error: {self.best_error}')
-                self.socketio.emit('error', {'cmd': 'error', 'name': msg['name'], 'error': msg['error']})
-                if self.best_error == None or msg['error'] < self.best_error:
+                job = self.message_job(msg)
+                if job is None: return
+                print(f'error: {job.name} best_error: {job.best_error}')
+                job.report(request.sid, msg['error'], msg.get('temperature'))
+                self.socketio.emit('error', {'cmd': 'error', 'job': job.id, 'name': msg['name'], 'error': msg['error'], 'role': job.role(request.sid), 'temperature': msg.get('temperature')}, room='console')
+                if self.bots.get(request.sid, {}).get('job') != job.id:
+                    return      # the bot has moved on since; its solution is for another job now
+                if job.best_error == None or msg['error'] < job.best_error:
                     print(f"requesting solution for new best_error candidate: {msg['error']}")
                     self.socketio.emit('command', {'cmd': 'send_solution'}, room=request.sid)
+                elif job.role(request.sid) in EXPLORER_ROLES and (job.runner_up is None or msg['error'] < job.runner_up['error']):
+                    print(f"requesting solution for new runner-up candidate: {msg['error']}")
+                    self.socketio.emit('command', {'cmd': 'send_solution'}, room=request.sid)
                 else:
-                    print(f'ignoring inferior error: {self.best_error} {msg["error"]}')
-            
+                    print(f'ignoring inferior error: {job.best_error} {msg["error"]}')
+
             elif msg['cmd'] == 'solution':
                 print(f'command: {msg["cmd"]} error={msg["error"]}')
-                if self.best_error == None or msg['error'] < self.best_error:
-                    self.best_error = msg['error']
-
-                    # pull off the fitted_frequencies and delete them; the workers don't need it, and it's big
-                    self.fitted_frequencies = msg['solution']['fitted_frequencies']
-                    self.solution = msg
-                    self.solution['time'] = time.time()
-                    self.solutions.append(self.solution)
-                    del self.solution['solution']['fitted_frequencies']
-
-                    # could immediately update the other workers here
-                    #self.socketio.emit('command', {'cmd': 'update_solution', 'solution': self.solution}, broadcast=True)
+                self.record_metrics(request.sid, msg)
+                job = self.message_job(msg)
+                if job is None: return
+                role = job.role(request.sid)
+                if self.bots.get(request.sid, {}).get('protocol') == 'v3':
+                    # v3 bots send their solution without reporting the error first
+                    job.report(request.sid, msg['error'], msg.get('temperature'))
+                    self.socketio.emit('error', {'cmd': 'error', 'job': job.id, 'name': msg['name'], 'error': msg['error'], 'role': role, 'temperature': msg.get('temperature')}, room='console')
+                if job.accept_solution(msg, request.sid):
+                    if role in EXPLORER_ROLES:
+                        # an explorer beat the best; it refines its own solution from now on
+                        self.set_role(request.sid, job, 'best', notify=False)
+                    job.push_solution()
+
+            elif msg['cmd'] == 'converged':
+                job = self.message_job(msg)
+                if job is None or self.bots.get(request.sid, {}).get('job') != job.id: return
+                self.bot_converged(request.sid, job)
 
             elif msg['cmd'] == 'perturb':
-                self.socketio.emit('command', {'cmd': 'perturb', 'proportion': msg['proportion']}, broadcast=True)
-                 
+                # the console's job, or every job
+                job = self.jobs.get(msg.get('job'))
+                perturb = {'cmd': 'perturb', 'proportion': msg['proportion']}
+                if job is None:
+                    self.socketio.emit('command', perturb, broadcast=True)
+                    return
+                for protocol in PROTOCOLS:
+                    self.socketio.emit('command', perturb, room=job.room('bots-' + protocol))
+
 
         except Exception as e:
             print('exception in dispatch_command')
@@ -181,116 +371,160 @@ class SwarmBoss():
             print(traceback.format_exc())
 
 
-    def log_solution(self):
-        log_file = self.input_file_name.split('/')[-1].replace('.csv', '.json')
-        print(f'saving solution: {log_file}')
-        with open('output/' + log_file, 'a') as f:
-            f.write(json.dumps(self.solution) + '\n')
-
-
-    def update_chart(self):
-
-        if not self.solution:
-            print('aborting update_chart: no solution')
-            return ''
-
-        t_start = time.time()
-        self.chart_number += 1
-        self.chart_file_name = self.input_file_name.split('/')[-1].replace('.csv', '.png').replace(' ', '_')
-        print(f'updating chart: {self.chart_file_name}')
-        solution = self.solution['solution']
-
-        fig = plt.figure()
-        fig.set_size_inches(14, 14, forward=True)
-        fig.subplots_adjust(hspace=.3)
-        fig.suptitle(f'Analysis of {self.input_file_name} ({self.nrow} X {self.ncol})\nSolution {self.chart_number}: error={self.solution["error"]} a={solution["a"]}', fontsize='xx-large')
-        #loc = plticker.MultipleLocator(base=30)
-
-        # column analysis
-        ax = fig.add_subplot(4,1,1,
-            title = 'Column Coordinates and Multipliers',
-            xlabel = 'Column Coordinate',
-            ylabel = 'Column Multiplier')
-        ax.scatter(solution['cx'], solution['cm'])
-        props = {'color':'black'}
-        bottom, top = ax.get_ylim()
-        text_base = bottom + 0.05 * (top-bottom)
-        labels = []
-        for i in range(len(solution['cx'])):
-            cm = solution['cm'][i]
-            labels.append(ax.text(solution['cx'][i], text_base, f'{self.column_labels[i]} ({i} : {cm:0.3f})', props, rotation=90))
-        if self.args.adjust_text: adjust_text(labels, arrowprops=dict(arrowstyle='->', color='red'))
-
-        # row analysis
-        ax2 = fig.add_subplot(4,1,2, 
-            title = 'Row Coordinates and Multipliers',
-            xlabel = 'Row Coordinate',
-            ylabel = 'Row Multiplier')
-        ax2.scatter(solution['rx'], solution['rm'])
-        props = {'color':'black'}
-        bottom, top = ax2.get_ylim()
-        text_base = bottom + 0.05 * (top-bottom)
-        labels2 = []
-        for i in range(len(solution['rx'])):
-            rm = solution['rm'][i]
-            labels2.append(ax2.text(solution['rx'][i], text_base, f'{self.row_labels[i]} ({i} : {rm:0.3f})', props, rotation=90))
-        if self.args.adjust_text: adjust_text(labels2, arrowprops=dict(arrowstyle='->', color='red'))
-
-        # data heatmap
-        if hasattr(self, 'fitted_frequencies'):
-            ax3 = fig.add_subplot(4,1,3, 
-                title = 'Error Heat Map',
-                xlabel = 'Column',
-                ylabel = 'Row')
-            ax3.imshow(self.data - self.fitted_frequencies, cmap='bwr', interpolation='nearest')
-
-        # error vs. time
-        if len(self.solutions):
-            iterations_to_plot = 6
-            ax4 = fig.add_subplot(4,1,4, 
-                title = f'Error vs. Time for past {iterations_to_plot} solutions',
-                xlabel = 'Time (seconds since start)',
-                ylabel = 'Error')
-            e = []
-            t = []
-            t0 = self.solutions[0]['time']
-            for i in range(len(self.solutions)):
-                t.append(self.solutions[i]['time'] - t0)
-                e.append(self.solutions[i]['error'])
-            points = min(iterations_to_plot, len(self.solutions))
-            e = e[-points:]
-            t = t[-points:]
-            e_min = min(e)
-            e_max = max(e)
-            if e_max - e_min > 0:
-                plt.ylim([e_min, e_max])
-                ax4.plot(t, e)
-    
-        plt.savefig('output/' + self.chart_file_name)
-        plt.close()
-        t_end = time.time()
-        print(f'chart update time: {t_end-t_start} {self.chart_file_name}')
-        return self.chart_file_name
+    def send_to_bot(self, sid, protocol, msg):
+        self.socketio.emit('command', encode_command(msg, protocol), room=sid)
+
+
+    # scheduling bots across jobs
+    def assign(self, sid, job):
+        # Move a bot to job (or just bring it up to date, if it is there already): switch its
+        # rooms, and send it the job and the job's best solution
+        with self.bots_lock:
+            bot = self.bots.get(sid)
+            if bot is None: return
+            room = 'bots-' + bot['protocol']
+            old = self.jobs.get(bot['job'])
+            if old is not None and old is not job:
+                self.socketio.server.leave_room(sid, old.room(room), namespace='/')
+                old.remove_bot(sid)
+            self.socketio.server.enter_room(sid, job.room(room), namespace='/')
+            job.add_bot(sid)
+            bot['job'] = job.id
+            cached = job.job_hash in bot['jobs']
+            bot['jobs'].add(job.job_hash)
+            protocol = bot['protocol']
+        print(f'assigning {bot["name"]} to {job.name}' + (f' from {old.name}' if old is not None and old is not job else ''))
+
+        update = {'cmd': 'update_job_data', 'filename': job.input_file_name, 'job_hash': job.job_hash}
+        if not cached:
+            update['job_data'] = job.job_data
+        self.send_to_bot(sid, protocol, update)
+        solution = job.solution
+        if solution is not None:
+            self.send_to_bot(sid, protocol, {'cmd': 'update_solution', 'job': job.id, 'job_hash': job.job_hash, 'solution': solution})
+        else:
+            self.socketio.emit('command', {'cmd': 'random_start'}, room=sid)
+
+
+    def schedule_bot(self):
+        # The job a newly joined bot should work on: the one furthest below its share
+        jobs = list(self.jobs.values())
+        targets = allocate_bots(jobs, len(self.bots))
+        return max(jobs, key=lambda job: (targets[job.id] - len(job.bots), -len(job.bots)))
+
+
+    def bot_converged(self, sid, job):
+        # A bot's solution has stopped improving (FrequencyTableSolver.converged()): move it to
+        # a job that needs it more, or have it explore, or idle it.  An idle bot starts again
+        # when it gets a new best, a new job or a new role.
+        with self.bots_lock:
+            bot = self.bots.get(sid)
+            if bot is None: return
+            other = self.schedule_bot()
+            pooled = bot['pool']
+        print(f'{job.name}: {bot["name"]} converged')
+        if other is not job and not other.converged():
+            self.assign(sid, other)
+        elif not pooled and not job.tempering and self.args.strategy_interval > 0 and not job.converged() and sid != job.best_sid:
+            self.set_role(sid, job, job.explorer_role())
+        else:
+            print(f'{job.name}: idling {bot["name"]}')
+            self.socketio.emit('command', {'cmd': 'stop'}, room=sid)
+
+
+    def schedule(self):
+        # Move up to --schedule_moves bots from jobs that have more than their share (see
+        # swarmjob.allocate_bots) to jobs that have less
+        jobs = list(self.jobs.values())
+        with self.bots_lock:
+            targets = allocate_bots(jobs, len(self.bots))
+            spare = [sid for job in jobs for sid in sorted(job.bots)[:max(0, len(job.bots) - targets[job.id])]]
+            wanted = [job for job in jobs for i in range(max(0, targets[job.id] - len(job.bots)))]
+        for sid, job in list(zip(spare, wanted))[:self.args.schedule_moves]:
+            self.assign(sid, job)
+
+
+    # roles of the bots within each job
+    def set_role(self, sid, job, role, notify=True):
+        # Only bots refining the best are in the job's rooms, and get each new best
+        with self.bots_lock:
+            bot = self.bots.get(sid)
+            if bot is None or bot['job'] != job.id: return
+            job.set_role(sid, role)
+            room = job.room('bots-' + bot['protocol'])
+            if role == 'best':
+                self.socketio.server.enter_room(sid, room, namespace='/')
+            else:
+                self.socketio.server.leave_room(sid, room, namespace='/')
+            protocol = bot['protocol']
+        if notify:
+            print(f'{job.name}: {bot["name"]} now {role}')
+            self.send_to_bot(sid, protocol, job.role_command(role))
+
+
+    def set_temperature(self, sid, job, temperature):
+        # Tempering: a bot at temperature 0 refines the best like any other, the hotter ones
+        # wander on their own.  Only the temperature is sent; the bot keeps its solution.
+        self.set_role(sid, job, 'best' if temperature == 0 else 'tempering', notify=False)
+        with self.bots_lock:
+            bot = self.bots.get(sid)
+            if bot is None or bot['job'] != job.id: return
+            job.set_temperature(sid, temperature)
+            protocol = bot['protocol']
+        self.send_to_bot(sid, protocol, {'cmd': 'temperature', 'temperature': temperature})
+
+
+    def plan_strategy(self):
+        # Rebalance each job's mix of refining and exploring bots (SwarmJob.plan_roles()), or
+        # fill its tempering ladder (SwarmJob.plan_temperatures())
+        for job in list(self.jobs.values()):
+            with self.bots_lock:
+                pooled = {sid for sid in job.bots if self.bots.get(sid, {}).get('pool')}
+                if job.tempering:
+                    temperatures, changes = job.plan_temperatures(pooled), {}
+                else:
+                    temperatures, changes = {}, job.plan_roles(pooled)
+            for sid, temperature in temperatures.items():
+                self.set_temperature(sid, job, temperature)
+            for sid, role in changes.items():
+                self.set_role(sid, job, role)
+
+
+    def exchange(self):
+        # Replica exchange within each tempering job; see tempering.py
+        for job in list(self.jobs.values()):
+            if not job.tempering: continue
+            with self.bots_lock:
+                moves = job.plan_exchange()
+            if moves:
+                print(f'{job.name}: exchanging temperatures {moves}')
+            for sid, temperature in moves.items():
+                self.set_temperature(sid, job, temperature)
 
 
     def swarm_task(self):
 
         while True:
-            #print(f'swarm task: best_error={self.best_error} last_best_error={self.last_best_error}')
             now = time.time()
-            if (now - self.last_update_time) > args.update_interval:
-                #print(f'swarm task epoch timer fired best_error={self.best_error} last_best_error={self.last_best_error}')
+            for job in list(self.jobs.values()):
+                job.tick(now)
+
+            if now - self.last_schedule_time > self.args.schedule_interval:
+                self.last_schedule_time = now
+                self.schedule()
+
+            if self.args.strategy_interval > 0 and now - self.last_strategy_time > self.args.strategy_interval:
+                self.last_strategy_time = now
+                self.plan_strategy()
+
+            if now - self.last_exchange_time > self.args.exchange_interval:
+                self.last_exchange_time = now
+                self.exchange()
+
+            if now - self.last_update_time > self.args.update_interval:
                 self.last_update_time = now
-                if self.best_error != None and (self.last_best_error == None or self.best_error < self.last_best_error):
-                    self.last_best_error = self.best_error
-                    print(f'swarm task: sending updated solution: {self.best_error}')
-                    self.socketio.emit('command', {'cmd': 'update_solution', 'solution': self.solution}, broadcast=True)
-                    self.log_solution()
-                    if self.update_chart():
-                        self.socketio.emit('chart', {
-                            'cmd': 'update_chart', 
-                            'chart_url': '/chart?id=' + str(random.random())
-                        }, broadcast=True)
+                self.socketio.emit('jobs', self.job_summaries(), room='console')
+                self.socketio.emit('metrics', self.console_metrics(), room='console')
 
             self.socketio.sleep(1)
 
@@ -302,12 +536,25 @@ if __name__ == '__main__':
     default_workers = mp.cpu_count()
     parser = argparse.ArgumentParser('python3 swarm.py')
     parser.add_argument('--update_interval', default=5, type=int)
+    parser.add_argument('--push_interval', default=1, type=float, help='minimum seconds between solution updates to the bots')
     parser.add_argument('--workers', default=0, type=int)
-    parser.add_argument('--input_file', default='data/degree by family income_6x12.csv')
+    parser.add_argument('--input_file', action='append', help='a table to solve; repeat for more jobs (default: data/degree by family income_6x12.csv)')
+    parser.add_argument('--schedule_interval', default=30, type=float, help='seconds between moving bots between jobs')
+    parser.add_argument('--schedule_moves', default=2, type=int, help='most bots moved per schedule_interval')
+    parser.add_argument('--rate_window', default=120, type=float, help='seconds over which to measure a job\'s improvement rate')
+    parser.add_argument('--converged_rate', default=1e-4, type=float, help='a job has converged when its error improves by less than this fraction per minute')
+    parser.add_argument('--strategy_interval', default=20, type=float, help='seconds between reassigning bot roles within a job; 0 to have every bot refine the best')
+    parser.add_argument('--max_explore', default=.5, type=float, help='largest share of a job\'s bots exploring rather than refining the best')
+    parser.add_argument('--explore_rate', default=.01, type=float, help='improvement per minute at which half of max_explore bots explore')
+    parser.add_argument('--perturb_proportion', default=.05, type=float, help='how far explorers perturb the best solution')
+    parser.add_argument('--temperatures', default='', help='parallel tempering instead of explore roles: a ladder of relative temperatures, e.g. 0,.0001,.001')
+    parser.add_argument('--exchange_interval', default=10, type=float, help='seconds between tempering replica exchanges')
     parser.add_argument('--port', default=5000, type=int)
     parser.add_argument('--kill_bots', dest='kill_bots', action='store_true')
     parser.set_defaults(kill_bots=False)
     parser.add_argument('--swarm_worker', default='swarm_bot.py', type=str)
+    parser.add_argument('--pool', dest='pool', action='store_true', help='start the workers as one pooled bot')
+    parser.set_defaults(pool=False)
     parser.add_argument('--resume', dest='resume', action='store_true')
     parser.set_defaults(resume=False)
     parser.add_argument('--resume_index', default=-1, type=int)
@@ -319,9 +566,9 @@ if __name__ == '__main__':
 
     boss = SwarmBoss(args)
 
-    # start the 1Hz thread
-    swarm_thread = threading.Thread(target=boss.swarm_task)
-    swarm_thread.start()
+    # start the 1Hz task; it moves bots between rooms, so run it the server's way (a greenlet
+    # under gevent) rather than as a thread of its own
+    boss.socketio.start_background_task(boss.swarm_task)
 
     # run the server (never returns)
     if os.environ.get('PORT'):
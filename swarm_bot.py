@@ -12,6 +12,10 @@ import threading
 import time
 import traceback
 from frequencytablesolver import FrequencyTableSolver
+from jobcache import JobCache
+from solverpool import SolverPool
+from tempering import parse_temperatures
+from wireformat import LATEST_PROTOCOL, PROTOCOLS, decode_command, encode_command
 
 class SwarmBot():
 
@@ -27,7 +31,25 @@ class SwarmBot():
         self.best_error = None
         self.last_best_error = None
         self.solution_update = None
-        self.solver = FrequencyTableSolver()
+        self.job_cache = JobCache(args.job_cache)
+        self.job_hash = None        # the job we have loaded
+        self.solver_lock = threading.Lock()     # the solver thread vs. job changes from the boss
+        self.command_lock = threading.Lock()    # socketio runs each event in its own thread; keep them in order
+        solver_options = {'engine': args.engine, 'multipliers': args.multipliers, 'search': args.search, 'precision': args.precision}
+        self.solver = FrequencyTableSolver(**solver_options)
+        self.temperatures = parse_temperatures(args.temperatures) or [0]
+        self.solver.temperature = self.temperatures[0]
+        solver_settings = {'batch_seconds': args.batch_seconds, 'convergence_window': args.convergence_window}
+        for name, value in solver_settings.items():
+            setattr(self.solver, name, value)
+        self.converged = False      # last told the boss
+
+        # pooled mode: this one connection drives args.pool solver processes on this host,
+        # one per temperature if we have a ladder of them
+        self.pool = None
+        if args.pool > 0:
+            self.pool = SolverPool(args.pool, solver_options, args.iterations, self.temperatures, solver_settings)
+            self.last_pool_time = self.last_exchange_time = time.time()
 
         self.sio = None
         self.init_socketio()
@@ -94,19 +116,22 @@ class SwarmBot():
         self.sio.eio.ping_timeout = 63
         self.sio.emit(channel, msg)
 
-    def send_join(self, room):
+    def send_join(self, room, cached=True):
         if not self.name:
             print('Error: No name in send_join')
             return
         self.send('command', {
             'cmd': 'join',
             'name': self.name,
-            'bot': 'v1'
+            'bot': self.args.protocol,
+            'pool': self.args.pool,
+            'jobs': self.job_cache.hashes() if cached else []
         })
 
     def handle_command(self, msg):
         try:
-            self._handle_command(msg)
+            with self.command_lock:
+                self._handle_command(msg)
         except Exception as e:        
             print('exception in handle_command')
             print(str(e))
@@ -115,56 +140,75 @@ class SwarmBot():
     
     def _handle_command(self, msg):
 
+        decode_command(msg)
         print(self.now(), 'handle_command:', self.name, msg['cmd'], msg)
 
-        if msg['cmd'] == 'update_job_data':
-            self.solver.update_job_data(msg['job_data'])
-            self.solver.initialize_parameter_list()
-            if not hasattr(self.solver, 'rx'):
+        if msg['cmd'] == 'update_job_data' and not self.resolve_job_data(msg):
+            return
+
+        if self.pool:
+            self.handle_pool_command(msg)
+
+        elif msg['cmd'] == 'update_job_data':
+            # a new job, the first or one the boss moved us to; it follows up with its best
+            # solution or a random start
+            with self.solver_lock:
+                self.solver.update_job_data(msg['job_data'])
+                self.solver.initialize_parameter_list()
                 self.solver.get_random_starting_point()
-                self.running = True
+                self.solver.minimum_error = None
+                self.solver.temperature = self.temperatures[0]     # the boss's temperatures are per job
+                self.reset_job_state()
+            self.running = True
 
         elif msg['cmd'] == 'update_solution':
             if self.in_random_start: return     # ignore solution updates while random starting
+            if msg.get('job_hash', self.job_hash) != self.job_hash: return     # for the job we just left
             print(f'update_solution: solver.minimum_error: {self.solver.minimum_error}')
             if self.solver.minimum_error == None or msg['solution']['error'] < self.solver.minimum_error:
                 self.solution_update = msg
                 self.best_error = self.last_best_error = msg['solution']['error']
                 print(f'updated solution: {self.solver.minimum_error} {self.best_error}')
-            self.running = True
+                self.running = True     # something new to refine, even if the boss idled us
+            elif self.best_error == None or msg['solution']['error'] < self.best_error:
+                self.best_error = msg['solution']['error']     # the swarm's best, for submit_solution()
 
         elif msg['cmd'] == 'random_start':
             if self.in_random_start: return
             self.in_random_start = True
-            self.solver.initialize_starting_point()
-            self.send('command', {
-                'cmd': 'error',
-                'name': self.name,
-                'error': self.solver.evaluate()
-            })
+            with self.solver_lock:
+                self.solver.initialize_starting_point()
+                self.send_error(self.solver.evaluate_float64())
             self.running = True
             self.in_random_start = False
 
         elif msg['cmd'] == 'send_solution':
-            solution = {
-                'cmd': 'solution',
-                'name': self.name,
-                'error': self.solver.minimum_error,
-                'solution': {
-                    'rx': self.solver.rx.tolist(),
-                    'cx': self.solver.cx.tolist(),
-                    'rm': self.solver.rm.tolist(),
-                    'cm': self.solver.cm.tolist(),
-                    'a': self.solver.a,
-                    'fitted_frequencies': self.solver.fitted_frequencies.tolist()
-                }
-            }
-            #print(f'sending solution: {solution}')
-            self.send('command', solution)
+            with self.solver_lock:
+                self.send_solution(self.solver.evaluate_float64())
+
+        elif msg['cmd'] == 'restart':
+            # a new role from the boss: refine the solution it sends, perturbed by proportion,
+            # or start afresh if it sends none
+            with self.solver_lock:
+                if msg.get('solution'):
+                    self.solver.update_solution(msg['solution'])
+                    if msg['proportion'] > 0:
+                        self.solver.perturb_solution(msg)
+                else:
+                    self.solver.initialize_starting_point()
+                self.solver.minimum_error = None
+                self.solution_update = None
+                self.best_error = msg.get('best_error')
+                self.last_best_error = None
+            self.running = True
 
         elif msg['cmd'] == 'perturb':
             self.solver.perturb_solution(msg)
 
+        elif msg['cmd'] == 'temperature':
+            # our place on the boss's tempering ladder; see tempering.py
+            self.solver.temperature = msg['temperature']
+
         elif msg['cmd'] == 'run':
             self.running = True
 
@@ -178,43 +222,238 @@ class SwarmBot():
         else:
             self.log('ignoring unrecognized message:', msg)
 
+    def resolve_job_data(self, msg):
+        # Fill in msg['job_data'] from our cache if the boss left it out, or cache it if not.
+        # Returns False if there is nothing to do: we already have this job loaded, as after
+        # a reconnect, or we have to ask again for the data.
+        job_hash = msg.get('job_hash')
+        if job_hash is None: return True            # boss without job hashes
+        if 'job_data' not in msg:
+            filename, msg['job_data'] = self.job_cache.load(job_hash)
+            if msg['job_data'] is None:
+                self.log('job data not in cache, asking for it:', job_hash)
+                self.send_join('command', cached=False)
+                return False
+        else:
+            self.job_cache.store(job_hash, msg.get('filename'), msg['job_data'])
+        if job_hash == self.job_hash:
+            self.log('job data already loaded:', job_hash)
+            return False
+        self.job_hash = job_hash
+        return True
+
+    def reset_job_state(self):
+        # what we knew about the previous job's solutions
+        self.solution_update = None
+        self.best_error = None
+        self.last_best_error = None
+
+    def submits_solutions(self):
+        # v3: send the solution itself, along with the error it was measured at, in one message
+        return self.args.protocol == 'v3'
+
+    def submit_solution(self, error):
+        # last_best_error has already caught up with our solution; best_error is the best
+        # the swarm has told us about.  The boss will tell us if someone else beat us to it.
+        if self.best_error == None or error < self.best_error:
+            self.best_error = error
+            self.send_solution(error)
+        else:
+            self.send_error(error)
+
+    def send_error(self, error):
+        # the job hash lets the boss match reports that cross a job change in flight
+        self.send('command', self.with_status({
+            'cmd': 'error',
+            'name': self.name,
+            'job_hash': self.job_hash,
+            'error': error
+        }))
+
+    def with_status(self, msg):
+        # The boss exchanges temperatures between bots on the errors they report at them (a
+        # pool exchanges between its own workers), and keeps our solver metrics for /metrics
+        if self.pool:
+            msg['metrics'] = self.pool.metrics()
+        else:
+            msg['temperature'] = self.solver.temperature
+            msg['metrics'] = self.solver.metrics()
+        return msg
+
+    def send_converged(self, error):
+        # our solution has stopped improving; the boss may move us to another job, or idle us
+        self.send('command', {
+            'cmd': 'converged',
+            'name': self.name,
+            'job_hash': self.job_hash,
+            'error': error
+        })
+
+    def send_solution(self, error):
+        solution = {
+            'cmd': 'solution',
+            'name': self.name,
+            'job_hash': self.job_hash,
+            'error': error,
+            'solution': self.solver.solution_dict()
+        }
+        if self.args.protocol == 'v1':
+            # v1 bosses expect the fitted frequencies; newer ones compute them when charting
+            solution['solution']['fitted_frequencies'] = self.solver.fitted_frequencies.tolist()
+        #print(f'sending solution: {solution}')
+        self.send('command', encode_command(self.with_status(solution), self.args.protocol))
+
+    def handle_pool_command(self, msg):
+        # Same commands as above, fanned out to the pool's solver processes
+
+        if msg['cmd'] == 'update_job_data':
+            # our own solver reads the pool's shared table too; let go of the old one first
+            with self.solver_lock:
+                self.solver.data = self.solver.data64 = None
+                self.pool.update_job_data(msg['job_data'])
+                self.solver.update_job_data(self.pool.local_job_data(msg['job_data']))
+                self.reset_job_state()
+            self.running = True
+
+        elif msg['cmd'] == 'update_solution':
+            if msg.get('job_hash', self.job_hash) != self.job_hash: return     # for the job we just left
+            # each worker decides for itself whether the swarm's best beats its own solution
+            self.solution_update = msg
+            if self.pool.best_error == None or msg['solution']['error'] < self.pool.best_error:
+                self.best_error = self.last_best_error = msg['solution']['error']
+            elif self.best_error == None or msg['solution']['error'] < self.best_error:
+                self.best_error = msg['solution']['error']     # the swarm's best, for submit_solution()
+            self.running = True
+
+        elif msg['cmd'] == 'random_start':
+            self.pool.broadcast('random_start')
+            self.running = True
+
+        elif msg['cmd'] == 'send_solution':
+            # the pool's best is in shared memory; loading it into our own solver also gives the
+            # fitted frequencies that v1 bosses expect
+            with self.solver_lock:
+                error, solution = self.pool.best_solution()
+                if solution is None: return
+                self.solver.adopt_solution(solution)
+                self.send_solution(error)
+
+        elif msg['cmd'] == 'perturb':
+            self.pool.broadcast('perturb', msg)
+
+        elif msg['cmd'] == 'run':
+            self.pool.broadcast('run')
+            self.running = True
+
+        elif msg['cmd'] == 'stop':
+            self.pool.broadcast('stop')
+            self.running = False
+
+        elif msg['cmd'] == 'quit':
+            self.pool.terminate()
+            self.sio.disconnect()
+            os._exit(os.EX_OK)
+
+        else:
+            self.log('ignoring unrecognized message:', msg)
+
+    def pool_task(self):
+        # solver_task() for pooled mode: the workers do the solving, we just collect and report
+        iterations = self.pool.iterations
+        self.pool.collect()
+        now = time.time()
+        if self.pool.iterations > iterations:
+            print(f'{self.name} pool iterations/sec:{(self.pool.iterations-iterations)/(now-self.last_pool_time):.1f} errors {self.pool.errors} best {self.pool.best_error}')
+        self.last_pool_time = now
+
+        # parallel tempering between the workers, if they have a ladder of temperatures
+        if now - self.last_exchange_time > self.update_interval:
+            self.last_exchange_time = now
+            if self.pool.exchange():
+                print(f'{self.name} pool temperatures {self.pool.temperatures}')
+
+        # if a solution has arrived from the swarm, put it in the shared best slot; workers
+        # pick it up between batches if it beats their own
+        if self.solution_update != None:
+            record = self.solution_update['solution']
+            if getattr(self.solver, 'nrow', None) == len(record['solution']['rx']) and self.solver.ncol == len(record['solution']['cx']):
+                print(f'updating pool solution from server')
+                self.solver.adopt_solution(record['solution'])
+                self.pool.offer(record['error'], self.solver.solution_dict())
+            self.solution_update = None
+            self.last_update_time = now
+
+        # periodically update the swarm director with the pool's best error, and now and then
+        # even if it hasn't improved, for the metrics that go with it
+        elif now - self.last_update_time > self.update_interval and self.pool.best_error is not None:
+            if self.last_best_error == None or self.pool.best_error < self.last_best_error or now - self.last_update_time > self.args.metrics_interval:
+                self.last_update_time = now
+                self.last_best_error = self.pool.best_error
+                if self.submits_solutions():
+                    error, solution = self.pool.best_solution()
+                    self.solver.adopt_solution(solution)
+                    self.submit_solution(error)
+                else:
+                    self.send_error(self.pool.best_error)
+
+        # once every worker has converged, say so
+        converged = self.pool.converged()
+        if converged and not self.converged and self.pool.best_error is not None:
+            self.send_converged(self.pool.best_error)
+        self.converged = converged
+
     def solver_task(self):
 
         while True:
-            if self.running:
+            if self.running and self.pool:
+                with self.solver_lock:
+                    self.pool_task()
+                self.sio.sleep(.2)
+                continue
 
-                # imperative 1: advance our local solution
-                t1 = time.time()
-                random.seed()
-                self.solver.solve(iterations=self.args.iterations)
-                now = time.time()
-                print(f'{self.name} iterations/sec:{self.args.iterations/(now-t1)} error {self.solver.minimum_error}')
-
-                #print(f'rx_delta={self.solver.rx_delta}')
-                #print(f'cx_delta={self.solver.cx_delta}')
-                #print(f'rm_delta={self.solver.rm_delta}')
-                #print(f'cm_delta={self.solver.cm_delta}')
-                #print(f'a_delta={self.solver.a_delta}')
-
-                # imperative 2: if a better solution has arrived from the swarm, switch to it
-                if self.solution_update != None and not self.in_random_start:
-                    #print(f'solver_task: checking solution update {self.solution_update}')
-                    if self.solution_update['solution']['error'] < self.solver.minimum_error:
-                        print(f'updating solution from server')
-                        self.solver.update_solution(self.solution_update['solution'])
-                        self.solution_update = None
-                        self.last_update_time = now
-
-                # imperative 3: periodically update the swarm director with our local solution's minimum error
-                elif now - self.last_update_time > self.update_interval:
-                    if self.last_best_error == None or self.solver.minimum_error < self.last_best_error:
-                        self.last_update_time = now
-                        self.last_best_error = self.solver.minimum_error
-                        self.send('command', {
-                            'cmd': 'error',
-                            'name': self.name,
-                            'error': self.solver.minimum_error
-                        })
+            if self.running:
+                with self.solver_lock:
+                    # imperative 1: advance our local solution
+                    t1 = time.time()
+                    random.seed()
+                    iterations = self.solver.next_batch(self.args.iterations)
+                    self.solver.solve(iterations=iterations)
+                    now = time.time()
+                    print(f'{self.name} iterations/sec:{iterations/(now-t1)} error {self.solver.minimum_error}')
+
+                    #print(f'rx_delta={self.solver.rx_delta}')
+                    #print(f'cx_delta={self.solver.cx_delta}')
+                    #print(f'rm_delta={self.solver.rm_delta}')
+                    #print(f'cm_delta={self.solver.cm_delta}')
+                    #print(f'a_delta={self.solver.a_delta}')
+
+                    # imperative 2: if a better solution has arrived from the swarm, switch to it
+                    if self.solution_update != None and not self.in_random_start:
+                        #print(f'solver_task: checking solution update {self.solution_update}')
+                        if self.solution_update['solution']['error'] < self.solver.minimum_error:
+                            print(f'updating solution from server')
+                            self.solver.update_solution(self.solution_update['solution'])
+                            self.solution_update = None
+                            self.last_update_time = now
+
+                    # imperative 3: periodically update the swarm director with our local solution's minimum error;
+                    # above temperature 0 the error wanders, and the boss wants it for replica exchange anyway,
+                    # and now and then it goes unimproved for the metrics that go with it
+                    elif now - self.last_update_time > self.update_interval:
+                        if (self.last_best_error == None or self.solver.minimum_error < self.last_best_error or self.solver.temperature > 0
+                                or now - self.last_update_time > self.args.metrics_interval):
+                            self.last_update_time = now
+                            self.last_best_error = self.solver.minimum_error
+                            if self.submits_solutions():
+                                self.submit_solution(self.solver.evaluate_float64())
+                            else:
+                                self.send_error(self.solver.evaluate_float64())
+
+                    # imperative 4: tell the swarm director when our solution stops improving
+                    converged = self.solver.converged()
+                    if converged and not self.converged:
+                        self.send_converged(self.solver.evaluate_float64())
+                    self.converged = converged
 
             self.sio.sleep(.020)
 
@@ -223,21 +462,33 @@ if __name__ == '__main__':
 
     parser = argparse.ArgumentParser('python3 swarm_bot.py')
     parser.add_argument('--update_interval', default=2, type=int)
+    parser.add_argument('--metrics_interval', default=10, type=float, help='report at least this often, improved or not, for the controller\'s metrics')
     parser.add_argument('--url', default='http://localhost:5000')
     parser.add_argument('--workers', default=1, type=int)
-    parser.add_argument('--iterations', default=10, type=int)
+    parser.add_argument('--pool', default=0, type=int, help='run this many solver processes behind one connection')
+    parser.add_argument('--iterations', default=10, type=int, help='iterations in the first batch, or in every batch with --batch_seconds=0')
+    parser.add_argument('--batch_seconds', default=.5, type=float, help='size batches of iterations to take this long')
+    parser.add_argument('--convergence_window', default=1000, type=int, help='iterations without improvement before reporting convergence')
     parser.add_argument('--swarm_worker', default='swarm_bot.py', type=str)
+    parser.add_argument('--engine', default='twiddle', choices=['twiddle', 'lbfgs', 'jacobi'])
+    parser.add_argument('--multipliers', default='exact', choices=['exact', 'twiddle'])
+    parser.add_argument('--search', default='twiddle', choices=['twiddle', 'line'])
+    parser.add_argument('--precision', default='float64', choices=['float64', 'float32'])
+    parser.add_argument('--job_cache', default='cache/jobs', help='directory for job data received from the controller')
+    parser.add_argument('--protocol', default=LATEST_PROTOCOL, choices=PROTOCOLS, help='wire format; v1 for older bosses')
+    parser.add_argument('--temperatures', default='0', help='tempering ladder, e.g. 0,.0001,.001: one per pool worker or --workers bot, in turn')
 
     args = parser.parse_args()
     print('args:', args)
 
     if args.workers > 1:
         workers = []
-        command = ['python3', args.swarm_worker]
+        command = ['python3', args.swarm_worker, '--url=' + args.url, '--iterations=' + str(args.iterations), '--engine=' + args.engine, '--multipliers=' + args.multipliers, '--search=' + args.search, '--precision=' + args.precision, '--protocol=' + args.protocol, '--job_cache=' + args.job_cache, '--batch_seconds=' + str(args.batch_seconds), '--convergence_window=' + str(args.convergence_window), '--metrics_interval=' + str(args.metrics_interval)]
+        temperatures = parse_temperatures(args.temperatures) or [0]
         for worker in range(args.workers):
-            workers.append(Popen(command, stdout=DEVNULL, stderr=DEVNULL))
-            for worker in workers:
-                worker.wait()
+            workers.append(Popen(command + ['--temperatures=' + str(temperatures[worker % len(temperatures)])], stdout=DEVNULL, stderr=DEVNULL))
+        for worker in workers:
+            worker.wait()
 
     else:
         swarm_bot = SwarmBot(args, url=args.url)
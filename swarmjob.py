@@ -0,0 +1,473 @@
+# One table being solved by the swarm
+#
+# A SwarmJob holds everything the boss keeps per table: the data, the best solution and its
+# history, the solution log, the chart renderer and the socket.io rooms of its bots.  The
+# boss (swarm.py) owns a set of jobs and moves bots between them; allocate_bots() decides
+# how many bots each job should have.
+#
+# Within a job, each bot has a role (see plan_roles()): refine the best solution, refine the
+# runner-up (the best solution found in another basin), refine a perturbed copy of the best,
+# or start afresh.  Only the bots refining the best get every new best solution; the others
+# work on their own until they beat it, or stall and get a new role.
+#
+# With a ladder of --temperatures the job runs parallel tempering instead (tempering.py):
+# each bot gets a temperature (plan_temperatures()), those at 0 refine the best, the rest
+# ('tempering') wander on their own, and plan_exchange() trades temperatures between them.
+
+import hashlib
+import random
+import threading
+import time
+import numpy as np
+from chartrenderer import ChartRenderer, ITERATIONS_TO_PLOT, fitted_frequencies
+from csvtable import read_table
+from jobcache import job_hash
+from solutionlog import SolutionLog
+from tempering import exchange, parse_temperatures
+from wireformat import PROTOCOLS, encode_command
+
+EXPLORER_ROLES = ('runner_up', 'perturb', 'random')
+
+
+class SwarmJob():
+
+    def __init__(self, input_file_name, socketio, args):
+        self.socketio = socketio
+        self.args = args
+        self.job_data = self.read_csv_data(input_file_name)
+        self.job_hash = job_hash(self.job_data)
+        self.id = self.job_hash[:12]
+        self.name = input_file_name.split('/')[-1].replace('.csv', '')
+        self.created_time = time.time()
+        self.bots = set()           # sids of the bots working on this job
+        self.roles = {}             # sid -> {'role', 'since', 'reports': [(time, error)], 'temperature', 'current'}
+        self.role_credit = {role: 1.0 for role in EXPLORER_ROLES}  # new bests found in each role, decaying
+        self.runner_up = None       # best solution from another basin than self.solution
+        self.best_sid = None        # the bot that found self.solution
+        self.work_time = 0          # seconds this job has had bots working on it
+        self.last_tick_time = None
+        self.progress = []          # (work_time, error) for each new best
+        self.tempering = sorted(set(parse_temperatures(args.temperatures)))     # the ladder, or []
+        self.exchange_round = 0
+        self.swaps = 0
+
+        self.solution = None
+        self.solutions = []
+        self.best_error = None
+        self.last_best_error = None # last logged and charted
+        self.last_pushed_error = None
+        self.last_push_time = 0
+        self.last_update_time = 0
+        self.solution_lock = threading.Lock()   # bots' solutions arrive on the server's threads
+        self.log = None             # SolutionLog, opened on first use
+
+        self.chart_number = 0
+        self.chart_file_name = self.input_file_name.split('/')[-1].replace('.csv', '.png').replace(' ', '_')
+        self.chart_png = None       # the latest chart, served from memory by /chart
+        self.chart_etag = None
+        self.renderer = None        # see start()
+
+
+    def start(self):
+        # The render process; not started until the boss takes the job on
+        self.renderer = ChartRenderer({
+            'input_file_name': self.input_file_name,
+            'nrow': self.nrow,
+            'ncol': self.ncol,
+            'column_labels': self.column_labels.tolist(),
+            'row_labels': self.row_labels.tolist(),
+            'data': self.job_data[4]
+        }, adjust_text=self.args.adjust_text)
+
+
+    # initialize data
+    def read_csv_data(self, file_name):
+        self.input_file_name = file_name
+        print(f'loading file: {file_name}')
+        column_labels, row_labels, self.data = read_table(file_name)
+        self.column_labels = np.array(column_labels)
+        self.row_labels = np.array(row_labels)
+        self.nrow, self.ncol = np.shape(self.data)
+        return (self.nrow, self.ncol, self.column_labels.tolist(), self.row_labels.tolist(), self.data.tolist())
+
+
+    def room(self, kind):
+        # socket.io room for this job's bots ('bots-v1', 'bots-v2', ...)
+        return f'{self.id}/{kind}'
+
+
+    def summary(self):
+        return {
+            'job': self.id,
+            'name': self.name,
+            'filename': self.input_file_name,
+            'nrow': self.nrow,
+            'ncol': self.ncol,
+            'bots': len(self.bots),
+            'error': self.best_error,
+            'solutions': len(self.solutions),
+            'improvement_rate': self.improvement_rate(self.args.rate_window),
+            'converged': self.converged(),
+            'runner_up_error': self.runner_up['error'] if self.runner_up else None,
+            'roles': {role: sum(1 for r in list(self.roles.values()) if r['role'] == role) for role in ('best', 'tempering') + EXPLORER_ROLES},
+            'swaps': self.swaps
+        }
+
+
+    # solutions
+    def solution_log(self):
+        return SolutionLog('output/' + self.input_file_name.split('/')[-1].replace('.csv', '.json'), writer=True)
+
+
+    def load_last_solution(self, index):
+        log = self.solution_log()
+        print(f'resuming from solution in {log.file_name}')
+        saved_data = log.read(index)
+        print(f'resuming from solution: index={index} data={saved_data}')
+        self.solution = saved_data
+        self.solution['time'] = time.time()
+        self.solutions.append(self.solution)
+        self.best_error = saved_data['error']
+        self.progress.append((self.work_time, self.best_error))
+
+
+    def accept_solution(self, msg, sid=None):
+        # Take msg, from bot sid, as the new best if it beats the current one; returns True if
+        # it did.  Otherwise a solution from an explorer may still be the new runner-up.
+        # v1 bots send fitted_frequencies; the workers don't need it, and it's big, so drop
+        # it and compute it from the solution when charting
+        msg['solution'].pop('fitted_frequencies', None)
+        role = self.role(sid) or 'best'
+        with self.solution_lock:
+            if self.best_error != None and not msg['error'] < self.best_error:
+                if role in EXPLORER_ROLES and (self.runner_up is None or msg['error'] < self.runner_up['error']):
+                    print(f'{self.name}: new runner-up from {role} bot: {msg["error"]}')
+                    self.runner_up = dict(msg, time=time.time())
+                    return False
+                print(f'{self.name}: ignoring inferior solution: {self.best_error} {msg["error"]}')
+                return False
+            if role in EXPLORER_ROLES:
+                # an explorer found a better basin: the old best is now the one to beat in another
+                self.role_credit[role] += 1
+                if self.solution is not None:
+                    self.runner_up = self.solution
+            self.best_error = msg['error']
+            self.best_sid = sid
+            self.solution = msg
+            self.solution['time'] = time.time()
+            self.solutions.append(self.solution)
+            self.progress.append((self.work_time, self.best_error))
+        return True
+
+
+    def push_solution(self):
+        # Broadcast the best solution if it hasn't been yet, at most once per push_interval.
+        # Anything held back goes out on the boss's next tick.
+        with self.solution_lock:
+            if self.best_error == None or (self.last_pushed_error != None and not self.best_error < self.last_pushed_error):
+                return
+            now = time.time()
+            if now - self.last_push_time < self.args.push_interval:
+                return
+            self.last_push_time = now
+            self.last_pushed_error = self.best_error
+            solution = self.solution
+        print(f'{self.name}: sending updated solution: {solution["error"]}')
+        self.broadcast_solution(solution)
+
+
+    def broadcast_solution(self, solution):
+        # each group of bots in its own format; the consoles get JSON
+        msg = {'cmd': 'update_solution', 'job': self.id, 'job_hash': self.job_hash, 'solution': solution}
+        for protocol in PROTOCOLS:
+            self.socketio.emit('command', encode_command(msg, protocol), room=self.room('bots-' + protocol))
+        self.socketio.emit('command', msg, room='console')
+        self.socketio.emit('live_solution', self.live_solution(solution), room='console')
+
+
+    def log_solution(self):
+        if self.log is None:
+            self.log = self.solution_log()
+        print(f'saving solution: {self.log.file_name}')
+        self.log.append(self.solution)
+
+
+    # progress, for the scheduler.  Measured in work time, the time the job has had bots, so
+    # that a job the scheduler has taken all the bots from keeps the rate it had rather than
+    # looking converged
+    def error_at(self, work_time):
+        # the best error as of work_time, or None if there wasn't one yet
+        for t, error in reversed(self.progress):
+            if t <= work_time:
+                return error
+        return None
+
+
+    def improvement_rate(self, window):
+        # relative improvement in the best error per minute over the last window seconds of
+        # work; None until the job has had a solution for that long
+        if not self.progress or self.progress[0][0] > self.work_time - window:
+            return None
+        then = self.error_at(self.work_time - window)
+        if not then: return 0.0
+        return (then - self.best_error) / then * 60 / window
+
+
+    def converged(self):
+        rate = self.improvement_rate(self.args.rate_window)
+        return rate is not None and rate < self.args.converged_rate
+
+
+    # roles of the bots within the job
+    def add_bot(self, sid):
+        self.bots.add(sid)
+        self.set_role(sid, 'best')
+
+
+    def remove_bot(self, sid):
+        self.bots.discard(sid)
+        self.roles.pop(sid, None)
+
+
+    def set_role(self, sid, role):
+        self.roles[sid] = {'role': role, 'since': time.time(), 'reports': []}
+
+
+    def role(self, sid):
+        return self.roles[sid]['role'] if sid in self.roles else None
+
+
+    def set_temperature(self, sid, temperature):
+        # after set_role(); the bot's error is unknown until it reports at the new temperature
+        if sid not in self.roles: return
+        self.roles[sid]['temperature'] = temperature
+        self.roles[sid]['current'] = None
+
+
+    def report(self, sid, error, temperature=None):
+        # a bot's own error, for its improvement rate, and for replica exchange if it was
+        # measured at the temperature we gave the bot
+        if sid not in self.roles: return
+        if temperature is not None and temperature == self.roles[sid].get('temperature'):
+            self.roles[sid]['current'] = error
+        now = time.time()
+        reports = self.roles[sid]['reports']
+        reports.append((now, error))
+        while len(reports) > 1 and reports[1][0] < now - self.args.rate_window:
+            reports.pop(0)
+
+
+    def bot_rate(self, sid):
+        # relative improvement in a bot's own error per minute over the last rate_window
+        # seconds; bots only report when they improve, so no reports means no improvement
+        window = self.args.rate_window
+        reports = self.roles[sid]['reports']
+        if not reports or reports[-1][0] < time.time() - window: return 0.0
+        start, latest = reports[0][1], reports[-1][1]
+        return (start - latest) / start * 60 / window if start else 0.0
+
+
+    def explore_fraction(self):
+        # the share of bots that should be exploring: none while the best is improving quickly,
+        # rising to max_explore as the error curve flattens
+        rate = self.improvement_rate(self.args.rate_window)
+        if rate is None: return 0.0
+        return self.args.max_explore * self.args.explore_rate / (self.args.explore_rate + max(rate, 0))
+
+
+    def plan_roles(self, pooled=()):
+        # Returns {sid: role} for the bots whose role should change.  Pooled bots share one
+        # best solution among their workers, so they always refine the best.
+        if self.solution is None: return {}
+        now = time.time()
+        window = self.args.rate_window
+        for role in self.role_credit:
+            self.role_credit[role] = max(.2, self.role_credit[role] * .9)
+
+        bots = [sid for sid in list(self.roles) if sid not in pooled]
+        explorers = [sid for sid in bots if self.role(sid) != 'best']
+        refiners = [sid for sid in bots if self.role(sid) == 'best']
+        wanted = min(len(bots) - 1, round(self.explore_fraction() * len(bots)))
+        changes = {}
+
+        # too many explorers: those furthest behind go back to refining the best
+        latest = lambda sid: self.roles[sid]['reports'][-1][1] if self.roles[sid]['reports'] else np.inf
+        for sid in sorted(explorers, key=latest, reverse=True)[:max(0, len(explorers) - wanted)]:
+            changes[sid] = 'best'
+
+        # too few: the refiners improving least explore instead, but not the one that found the best
+        candidates = [sid for sid in refiners if sid != self.best_sid and now - self.roles[sid]['since'] > window]
+        for sid in sorted(candidates, key=self.bot_rate)[:max(0, wanted - len(explorers))]:
+            changes[sid] = self.explorer_role()
+
+        # explorers that have stalled try something else
+        for sid in explorers:
+            if sid not in changes and now - self.roles[sid]['since'] > window and self.bot_rate(sid) < self.args.converged_rate:
+                changes[sid] = self.explorer_role()
+        return changes
+
+
+    def plan_temperatures(self, pooled=()):
+        # Tempering: returns {sid: temperature} for the bots that need a place on the ladder.
+        # New bots go to the rungs with the fewest bots, coldest first; a rung left empty by a
+        # bot that went away takes one from the most crowded rung.  Pooled bots run their own
+        # ladder, if any (SolverPool.exchange()).
+        bots = [sid for sid in list(self.roles) if sid not in pooled]
+        rungs = {t: [sid for sid in bots if self.roles[sid].get('temperature') == t] for t in self.tempering}
+        fewest = lambda: min(self.tempering, key=lambda t: len(rungs[t]))
+        changes = {}
+        for sid in bots:
+            if self.roles[sid].get('temperature') not in rungs:
+                t = fewest()
+                rungs[t].append(sid)
+                changes[sid] = t
+        while True:
+            empty, crowded = fewest(), max(self.tempering, key=lambda t: len(rungs[t]))
+            if rungs[empty] or len(rungs[crowded]) < 2: break
+            sid = rungs[crowded].pop()
+            rungs[empty].append(sid)
+            changes[sid] = empty
+        return changes
+
+
+    def plan_exchange(self):
+        # Tempering: {sid: temperature} for the bots that trade places this round
+        if self.best_error is None: return {}
+        replicas = {sid: (r['temperature'], r['current']) for sid, r in list(self.roles.items()) if r.get('temperature') is not None}
+        moves = exchange(replicas, self.best_error, self.exchange_round)
+        self.exchange_round += 1
+        self.swaps += len(moves) // 2
+        return moves
+
+
+    def explorer_role(self):
+        # weighted by how often each role has found a new best lately
+        roles = [role for role in EXPLORER_ROLES if role != 'runner_up' or self.runner_up is not None]
+        return random.choices(roles, weights=[self.role_credit[role] for role in roles])[0]
+
+
+    def role_command(self, role):
+        # what to send a bot to start it on role
+        if role == 'best':
+            return {'cmd': 'update_solution', 'job': self.id, 'job_hash': self.job_hash, 'solution': self.solution}
+        msg = {'cmd': 'restart', 'role': role, 'job_hash': self.job_hash, 'best_error': self.best_error, 'proportion': 0}
+        if role == 'runner_up':
+            msg['solution'] = self.runner_up
+        elif role == 'perturb':
+            msg['solution'] = self.solution
+            msg['proportion'] = self.args.perturb_proportion
+        return msg
+
+
+    # live charts (see templates/index.html) and rendered charts
+    def live_solution(self, solution):
+        # The part of the /solution response that changes with each new best
+        return {
+            'job': self.id,
+            'error': solution['error'],
+            'name': solution.get('name'),
+            'solution': {key: solution['solution'][key] for key in ('rx', 'cx', 'rm', 'cm', 'a')},
+            'residuals': (self.data - fitted_frequencies(solution['solution'])).tolist(),
+            'history_point': self.error_history([solution])
+        }
+
+
+    def live_state(self):
+        # Everything the console needs to draw its own charts; 'live_solution' events keep it current
+        live = {
+            'job': self.id,
+            'filename': self.input_file_name,
+            'nrow': self.nrow,
+            'ncol': self.ncol,
+            'column_labels': self.column_labels.tolist(),
+            'row_labels': self.row_labels.tolist(),
+            'history': self.error_history(self.solutions)
+        }
+        if self.solution is not None:
+            live.update(self.live_solution(self.solution))
+        return live
+
+
+    def error_history(self, solutions):
+        # (seconds since the first solution, error) for each solution, as two lists
+        if not self.solutions: return {'time': [], 'error': []}
+        t0 = self.solutions[0]['time']
+        return {'time': [s['time'] - t0 for s in solutions], 'error': [s['error'] for s in solutions]}
+
+
+    def update_chart(self):
+        # Hand the current best to the render process; the chart arrives later, see poll_chart()
+        if not self.solution:
+            print('aborting update_chart: no solution')
+            return
+        self.chart_number += 1
+        solutions = self.solutions[-ITERATIONS_TO_PLOT:]
+        t0 = self.solutions[0]['time']
+        self.renderer.submit({
+            'chart_number': self.chart_number,
+            'error': self.solution['error'],
+            'solution': self.solution['solution'],
+            'history': ([s['time'] - t0 for s in solutions], [s['error'] for s in solutions])
+        })
+
+
+    def poll_chart(self):
+        # Returns True when a new chart has come back from the render process
+        chart = self.renderer.poll()
+        if chart is None: return False
+        chart_number, self.chart_png, seconds = chart
+        self.chart_etag = hashlib.sha1(self.chart_png).hexdigest()
+        print(f'chart update time: {seconds} {self.chart_file_name} (solution {chart_number})')
+        with open('output/' + self.chart_file_name, 'wb') as f:
+            f.write(self.chart_png)
+        return True
+
+
+    def tick(self, now):
+        # The boss's once a second housekeeping for this job
+        if self.bots and self.last_tick_time is not None:
+            self.work_time += now - self.last_tick_time
+        self.last_tick_time = now
+        self.push_solution()
+        if self.best_error != None and (self.last_best_error == None or self.best_error < self.last_best_error):
+            if now - self.last_update_time > self.args.update_interval:
+                self.last_update_time = now
+                self.last_best_error = self.best_error
+                self.log_solution()
+                self.update_chart()
+        if self.poll_chart():
+            self.socketio.emit('chart', {
+                'cmd': 'update_chart',
+                'job': self.id,
+                'chart_url': f'/chart?job={self.id}&id={now}'
+            }, room='console')
+
+
+def allocate_bots(jobs, bots):
+    # How many of the bots each job should have: jobs that are still improving share them in
+    # proportion to their improvement rate, with new jobs (no rate yet) weighted like the
+    # fastest; converged jobs get none.  If every job has converged, they all share evenly.
+    active = [job for job in jobs if not job.converged()]
+    if not active:
+        active = list(jobs)
+    if not active or bots == 0:
+        return {job.id: 0 for job in jobs}
+    rates = {job.id: job.improvement_rate(job.args.rate_window) for job in active}
+    known = [rate for rate in rates.values() if rate is not None and rate > 0]
+    fastest = max(known) if known else 1.0
+    weights = {id: (fastest if rate is None else max(rate, fastest * .05)) for id, rate in rates.items()}
+
+    # every active job gets a bot if there are enough; the rest by weight, largest remainder first
+    targets = {job.id: 0 for job in jobs}
+    spare = bots
+    for job in sorted(active, key=lambda job: -weights[job.id])[:bots]:
+        targets[job.id] = 1
+        spare -= 1
+    total = sum(weights.values())
+    shares = {id: spare * weight / total for id, weight in weights.items()}
+    for id, share in shares.items():
+        targets[id] += int(share)
+    left = bots - sum(targets.values())
+    for id in sorted(shares, key=lambda id: -(shares[id] - int(shares[id])))[:left]:
+        targets[id] += 1
+    return targets
@@ -0,0 +1,50 @@
+# Replica exchange for parallel tempering
+#
+# Each replica is a solver running at its own temperature: above zero it also takes some
+# moves that make its error worse (FrequencyTableSolver.accepts()), so the hot replicas can
+# climb out of a basin that the cold ones are stuck in.  Now and then replicas at neighbouring
+# temperatures offer to trade places; a swap is taken with probability
+#
+#   min(1, exp((1/t_cold - 1/t_hot) * (e_cold - e_hot) / reference))
+#
+# so good solutions found while hot drift down the ladder to the cold end.  Only the
+# temperatures move: each solution stays with its solver, and a swap is a couple of small
+# messages rather than two solutions.
+#
+# Temperatures are relative error increases, as in accepts(); reference is the best error
+# known, which turns them into absolute ones.  A replica at temperature 0 is pure descent,
+# so it takes a swap only for a better solution.
+#
+# Used between the processes of a SolverPool (solverpool.py) and between the bots of a job
+# (swarmjob.py).
+
+import math
+import random
+
+
+def parse_temperatures(text):
+    # '0,.0001,.001' -> [0.0, 0.0001, 0.001]
+    return [float(t) for t in text.split(',') if t.strip()]
+
+
+def swap_accepted(cold, hot, reference):
+    # cold and hot are (temperature, error), cold being the lower temperature
+    (t_cold, e_cold), (t_hot, e_hot) = cold, hot
+    if e_hot < e_cold: return True
+    if t_cold <= 0: return False
+    return random.random() < math.exp((1/t_cold - 1/t_hot) * (e_cold - e_hot) / reference)
+
+
+def exchange(replicas, reference, parity):
+    # replicas is {key: (temperature, error)}, error None until the replica has reported at
+    # its temperature.  Pairs up neighbours on the ladder, starting from the coldest or the
+    # next one by parity so that successive rounds alternate, and returns {key: temperature}
+    # for every replica that moved.
+    ladder = sorted((key for key, (t, e) in replicas.items() if e is not None and math.isfinite(e)), key=lambda key: replicas[key][0])
+    moves = {}
+    for k in range(parity % 2, len(ladder) - 1, 2):
+        cold, hot = ladder[k], ladder[k + 1]
+        if replicas[cold][0] == replicas[hot][0]: continue
+        if swap_accepted(replicas[cold], replicas[hot], reference):
+            moves[cold], moves[hot] = replicas[hot][0], replicas[cold][0]
+    return moves
@@ -0,0 +1,117 @@
+# Tests for the solver's incremental evaluation and analytic gradient
+#
+#   python -m pytest test_frequencytablesolver.py
+
+import random
+
+import numpy as np
+import pytest
+
+from frequencytablesolver import FrequencyTableSolver
+
+TABLE = 'data/degree by family income_6x12.csv'
+
+
+@pytest.fixture
+def solver():
+    np.random.seed(1)
+    random.seed(1)
+    solver = FrequencyTableSolver()
+    solver.read_csv_data(TABLE)
+    solver.get_random_starting_point()
+    solver.minimum_error = solver.evaluate()
+    return solver
+
+
+def full_error(solver):
+    # the error from scratch, without touching the solver's caches
+    return solver.gradient()[0]
+
+
+def copy_of_solution(solver):
+    # save_solution() hands back the arrays themselves, which move() changes in place
+    return tuple(np.copy(value) for value in solver.save_solution()[:4]) + (solver.a,)
+
+
+def move(solver, kind, i, factor):
+    # a trial move of one parameter, as the twiddle engine makes them
+    if kind == 'a':
+        solver.a *= factor
+    elif kind in ('rx', 'cx'):
+        getattr(solver, kind)[i] += factor - 1
+    else:
+        getattr(solver, kind)[i] *= factor
+
+
+@pytest.mark.parametrize('kind', ['rx', 'cx', 'rm', 'cm', 'a'])
+def test_trial_matches_full_evaluation(solver, kind):
+    move(solver, kind, 2, 1.05)
+    assert solver.evaluate_trial(kind, 2) == pytest.approx(full_error(solver), rel=1e-10)
+
+
+@pytest.mark.parametrize('kind', ['rx', 'cx', 'rm', 'cm', 'a'])
+def test_commit_updates_caches(solver, kind):
+    move(solver, kind, 3, .97)
+    solver.evaluate_trial(kind, 3)
+    solver.commit_trial()
+    fitted, cells, error = solver.fitted_frequencies.copy(), solver.cell_errors.copy(), solver.cached_error
+    assert error == pytest.approx(solver.evaluate(), rel=1e-10)
+    assert np.allclose(fitted, solver.fitted_frequencies, rtol=1e-12)
+    assert np.allclose(cells, solver.cell_errors, rtol=1e-10)
+
+
+@pytest.mark.parametrize('kind', ['rx', 'cx', 'rm', 'cm', 'a'])
+def test_rejected_trial_leaves_caches(solver, kind):
+    fitted, cells, error = solver.fitted_frequencies.copy(), solver.cell_errors.copy(), solver.cached_error
+    saved = copy_of_solution(solver)
+    move(solver, kind, 1, 1.2)
+    solver.evaluate_trial(kind, 1)
+    solver.restore_solution(saved)
+    assert solver.cached_error == error
+    assert np.array_equal(solver.fitted_frequencies, fitted)
+    assert np.array_equal(solver.cell_errors, cells)
+    assert solver.evaluate_trial(kind, 1) == pytest.approx(error, rel=1e-12)
+
+
+def test_random_trials_track_full_evaluation(solver):
+    solver.resync_interval = 10**9
+    kinds = [('rx', solver.nrow), ('cx', solver.ncol), ('rm', solver.nrow), ('cm', solver.ncol), ('a', 1)]
+    for step in range(500):
+        kind, count = kinds[step % len(kinds)]
+        i = random.randrange(count)
+        saved = copy_of_solution(solver)
+        move(solver, kind, i, random.uniform(.9, 1.1))
+        if solver.evaluate_trial(kind, i) < solver.cached_error:
+            solver.commit_trial()
+        else:
+            solver.restore_solution(saved)
+    assert solver.cached_error == pytest.approx(full_error(solver), rel=1e-9)
+
+
+@pytest.mark.parametrize('options', [{}, {'search': 'line'}, {'engine': 'jacobi'}, {'multipliers': 'twiddle'}])
+def test_solve_keeps_caches_in_step(options):
+    np.random.seed(2)
+    random.seed(2)
+    solver = FrequencyTableSolver(**options)
+    solver.read_csv_data(TABLE)
+    solver.get_random_starting_point()
+    error, _ = solver.solve(iterations=20)
+    assert error == pytest.approx(full_error(solver), rel=1e-9)
+    assert solver.cached_error == pytest.approx(full_error(solver), rel=1e-9)
+
+
+def error_at(solver, theta):
+    solver.set_parameter_vector(theta)
+    return solver.gradient()[0]
+
+
+def test_gradient_matches_finite_differences(solver):
+    theta = solver.get_parameter_vector()
+    _, grad = solver.gradient()
+    step = 1e-6
+    numeric = np.empty_like(theta)
+    for k in range(len(theta)):
+        shift = np.zeros_like(theta)
+        shift[k] = step
+        numeric[k] = (error_at(solver, theta + shift) - error_at(solver, theta - shift)) / (2 * step)
+    assert np.allclose(grad, numeric, rtol=1e-5, atol=1e-6 * np.max(np.abs(grad)))
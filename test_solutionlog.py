@@ -0,0 +1,54 @@
+# Tests for the indexed solution log
+#
+#   python -m pytest test_solutionlog.py
+
+from solutionlog import INDEX_RECORD, SolutionLog
+
+
+def record(k):
+    return {'error': 30.0 - k, 'time': float(k), 'solution': {'a': k}}
+
+
+def filled_log(tmp_path, count):
+    log = SolutionLog(str(tmp_path / 'job.json'), writer=True)
+    for k in range(count):
+        log.append(record(k))
+    return log
+
+
+def test_append_and_read(tmp_path):
+    log = filled_log(tmp_path, 5)
+    assert len(log) == 5
+    assert log.read(2) == record(2)
+    assert log.read(-1) == record(4)
+    assert log.best() == record(4)
+    assert log.tail(2) == [record(3), record(4)]
+
+
+def test_index_rebuilt(tmp_path):
+    log = filled_log(tmp_path, 5)
+    (tmp_path / 'job.json.idx').unlink()
+    log = SolutionLog(log.file_name)
+    assert len(log) == 5 and log.best_index() == 4
+
+
+def test_torn_index_record(tmp_path):
+    log = filled_log(tmp_path, 3)
+    with open(log.index_file_name, 'ab') as index:
+        index.write(b'\0' * (INDEX_RECORD.itemsize // 2))
+    log = SolutionLog(log.file_name, writer=True)
+    log.append(record(3))
+    assert len(log) == 4
+    assert [log.read(k) for k in range(4)] == [record(k) for k in range(4)]
+
+
+def test_torn_log_line(tmp_path):
+    log = filled_log(tmp_path, 3)
+    with open(log.file_name, 'ab') as f:
+        f.write(b'{"error": 1')
+    reader = SolutionLog(log.file_name)
+    assert len(reader) == 3                     # a reader leaves what may be a write in progress
+    log = SolutionLog(log.file_name, writer=True)
+    log.append(record(3))
+    assert [log.read(k) for k in range(4)] == [record(k) for k in range(4)]
+    assert SolutionLog(log.file_name).best() == record(3)
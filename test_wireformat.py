@@ -0,0 +1,83 @@
+# Tests for the boss <-> bot wire formats
+#
+#   python -m pytest test_wireformat.py
+
+import sys
+import threading
+
+import numpy as np
+import socketio
+from werkzeug.serving import make_server
+
+from wireformat import decode_command, encode_command
+
+
+def solution(nrow, ncol, seed):
+    rng = np.random.default_rng(seed)
+    return {'rx': rng.random(nrow), 'cx': rng.random(ncol), 'rm': rng.random(nrow) * 100, 'cm': rng.random(ncol), 'a': 1.5 + seed}
+
+
+def solution_command(nrow, ncol, seed):
+    return {'cmd': 'solution', 'name': 'bot', 'job': 1, 'error': 25.0 + seed, 'solution': solution(nrow, ncol, seed)}
+
+
+def test_round_trip():
+    for protocol in ('v2', 'v3'):
+        msg = solution_command(6, 12, 0)
+        decoded = decode_command(encode_command(msg, protocol))
+        for key in ('rx', 'cx', 'rm', 'cm'):
+            assert np.array_equal(decoded['solution'][key], msg['solution'][key])
+        assert decoded['solution']['a'] == msg['solution']['a']
+        assert decode_command(encode_command(msg, protocol), as_lists=True)['solution']['rx'] == msg['solution']['rx'].tolist()
+
+
+def test_one_attachment_per_solution():
+    msg = {'cmd': 'update_solution', 'job': 1, 'solution': {'error': 25.0, 'solution': solution(6, 12, 0)}}
+    encoded = socketio.packet.Packet(socketio.packet.EVENT, data=['command', encode_command(msg, 'v3')]).encode()
+    assert len(encoded) == 2                # the packet itself and one attachment
+
+
+def send_queued_solutions(count):
+    # Solutions sent back to back go out in one polling payload, which engine.io refuses if it
+    # holds more than 16 packets: the boss must get every one of them
+    received = []
+    everything = threading.Event()
+    server = socketio.Server(async_mode='threading')
+
+    @server.on('command')
+    def command(sid, msg):
+        received.append(decode_command(msg))
+        if len(received) == count: everything.set()
+
+    http = make_server('localhost', 0, socketio.WSGIApp(server), threaded=True)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+    client = socketio.Client()
+    connected = threading.Event()
+    client.on('connect', connected.set)
+    try:
+        client.connect(f'http://localhost:{http.server_port}', transports=['polling'])
+        assert connected.wait(10)
+        sent = [solution_command(6, 12, seed) for seed in range(count)]
+        # emit() only queues the packets; keep the client's writer from waking between them
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1)
+        try:
+            for msg in sent:
+                client.emit('command', encode_command(msg, 'v3'))
+        finally:
+            sys.setswitchinterval(interval)
+        assert everything.wait(10)
+        for msg, got in zip(sent, received):
+            assert got['error'] == msg['error']
+            assert np.array_equal(got['solution']['cm'], msg['solution']['cm'])
+    finally:
+        client.disconnect()
+        http.shutdown()
+
+
+def test_two_queued_solutions_over_polling():
+    send_queued_solutions(2)
+
+
+def test_several_queued_solutions_over_polling():
+    send_queued_solutions(4)
@@ -0,0 +1,88 @@
+# Wire formats for the boss <-> bot protocol
+#
+# A bot names its format in the 'bot' field of its join command.
+#
+#   v1: everything is JSON lists, and solutions carry the full nrow X ncol fitted_frequencies
+#   v2: arrays travel as raw little-endian float64 bytes, which socket.io sends as binary
+#       attachments, one per solution or data table; messages in this format are marked
+#       'wire': 'v2'.  Fitted frequencies are not sent at all: the boss computes them from
+#       the solution when it draws a chart.
+#   v3: v2's encoding, and a bot whose solution beats the best it knows of sends the
+#       solution straight away, rather than sending its error and waiting for send_solution.
+#
+# The boss keeps solutions and job data in the v1 (JSON) form, for its log and for the web
+# console, and encodes per bot.
+
+import numpy as np
+
+PROTOCOLS = ('v1', 'v2', 'v3')
+LATEST_PROTOCOL = 'v3'
+
+
+def pack_array(a):
+    return np.ascontiguousarray(a, dtype='<f8').tobytes()
+
+
+def unpack_array(b):
+    # read-only view of the message buffer; the solver copies what it keeps
+    return np.frombuffer(b, dtype='<f8')
+
+
+def pack_solution(solution):
+    # solution is in FrequencyTableSolver.solution_dict() form.  The four arrays travel as one
+    # blob, with their lengths alongside, so that a solution is a single binary attachment:
+    # engine.io refuses a polling payload of more than 16 packets, and each attachment is one.
+    arrays = [solution[key] for key in ('rx', 'cx', 'rm', 'cm')]
+    return {
+        'lengths': [len(a) for a in arrays],
+        'arrays': pack_array(np.concatenate(arrays)),
+        'a': float(solution['a'])
+    }
+
+
+def unpack_solution(packed, as_lists=False):
+    convert = (lambda a: a.tolist()) if as_lists else (lambda a: a)
+    offsets = np.cumsum([0] + packed['lengths'])
+    arrays = unpack_array(packed['arrays'])
+    solution = {key: convert(arrays[offsets[k]:offsets[k + 1]]) for k, key in enumerate(('rx', 'cx', 'rm', 'cm'))}
+    solution['a'] = packed['a']
+    return solution
+
+
+def pack_job_data(job_data):
+    # a list, not a tuple: socket.io only looks inside lists and dicts for binary attachments
+    nrow, ncol, column_labels, row_labels, data = job_data
+    return [nrow, ncol, column_labels, row_labels, pack_array(data)]
+
+
+def unpack_job_data(packed):
+    nrow, ncol, column_labels, row_labels, data = packed
+    return (nrow, ncol, column_labels, row_labels, unpack_array(data).reshape(nrow, ncol))
+
+
+def encode_command(msg, protocol):
+    # Returns msg as it should be sent to a peer speaking protocol; msg itself is not modified
+    if protocol == 'v1': return msg
+    encoded = dict(msg, wire=protocol)
+    if 'job_data' in msg:
+        encoded['job_data'] = pack_job_data(msg['job_data'])
+    if msg['cmd'] == 'solution':
+        encoded['solution'] = pack_solution(msg['solution'])
+    elif msg['cmd'] in ('update_solution', 'restart') and msg.get('solution'):
+        # the boss's solution record, with the solution itself one level down
+        encoded['solution'] = dict(msg['solution'], solution=pack_solution(msg['solution']['solution']))
+    return encoded
+
+
+def decode_command(msg, as_lists=False):
+    # The inverse of encode_command(), in place.  as_lists gives JSON-ready lists rather than arrays.
+    if msg.pop('wire', 'v1') == 'v1': return msg
+    if 'job_data' in msg:
+        msg['job_data'] = unpack_job_data(msg['job_data'])
+        if as_lists:
+            msg['job_data'] = msg['job_data'][:4] + (msg['job_data'][4].tolist(),)
+    if msg['cmd'] == 'solution':
+        msg['solution'] = unpack_solution(msg['solution'], as_lists)
+    elif msg['cmd'] in ('update_solution', 'restart') and msg.get('solution'):
+        msg['solution']['solution'] = unpack_solution(msg['solution']['solution'], as_lists)
+    return msg